@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+
+"""
+Compares the throughput of random rollouts (steps per second) simulated one
+state at a time, with the successor generator and Action.apply, and
+simulated in batches with numpy (see planning_toolbox.batch.BatchTask).
+"""
+
+import os
+import sys
+import random
+import argparse
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from planning_toolbox.parser import parse_file
+
+
+PROBLEMS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "problems")
+
+
+def sequential_rollouts(problem, n, horizon, seed):
+    rng = random.Random(seed)
+    steps = goals = 0
+    for _ in range(n):
+        state = problem.get_initial_state()
+        for _ in range(horizon):
+            if problem.goal.is_satisfied(state): break
+            applicable = problem.applicable_actions(state)
+            if not applicable: break
+            state = rng.choice(applicable).apply(state)
+            steps += 1
+        goals += problem.goal.is_satisfied(state)
+    return steps, goals
+
+
+def batch_rollouts(task, n, horizon, seed):
+    rng = np.random.default_rng(seed)
+    states = task.initial_states(n)
+    steps = 0
+    for _ in range(horizon):
+        operators = task.sample_applicable(states, rng)
+        operators[task.goal_reached(states)] = -1
+        if np.all(operators < 0): break
+        states = task.apply(states, operators, rng)
+        steps += int(np.sum(operators >= 0))
+    return steps, int(np.sum(task.goal_reached(states)))
+
+
+def main(domain, problem, rollouts, horizon, seed):
+    domain = parse_file(os.path.join(PROBLEMS, domain))
+    problem = parse_file(os.path.join(PROBLEMS, problem), "problem", domain)
+    start = perf_counter()
+    task = problem.batch_task()
+    print("{} operators, {} facts, batch task built in {:.2f}s".format(
+        len(task.operators), task.nfacts, perf_counter()-start))
+    print("{:<12}{:>12}{:>14}{:>10}".format("rollouts", "steps", "steps/s", "goals"))
+    for name, run in (("sequential", lambda: sequential_rollouts(problem,
+            rollouts, horizon, seed)), ("batch", lambda: batch_rollouts(task,
+            rollouts, horizon, seed))):
+        start = perf_counter()
+        steps, goals = run()
+        elapsed = perf_counter() - start
+        print("{:<12}{:>12}{:>14.0f}{:>10}".format(name, steps, steps/elapsed, goals))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--domain", default="ppddl/ippc2006/tireworld/domain.pddl")
+    parser.add_argument("--problem", default="ppddl/ippc2006/tireworld/p05.pddl")
+    parser.add_argument("-n", "--rollouts", type=int, default=2000)
+    parser.add_argument("--horizon", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(**vars(args))
@@ -7,7 +7,7 @@ from tqdm import trange
 
 import numpy as np
 
-from planning_toolbox.parser import parse_file
+from planning_toolbox.parser import parse_file, parse_many, ParseCache
 from planning_toolbox.solvers import *
 from planning_toolbox.determinization import *
 from planning_toolbox.simulation import *
@@ -16,6 +16,8 @@ from planning_toolbox.agents import *
 
 PROBLEM_FILE_RE = re.compile(r"p[0-9]+\.pddl")
 
+PARSE_CACHE = ParseCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".parse_cache"))
+
 
 AGENTS = {
         # "ao-ff": SimpleDeterminizerAgent(None, AllOutcomeDeterminizer(), FDPlanner(search="astar(cea())")),
@@ -76,8 +78,9 @@ def get_summary(agname, rows):
 def main(folder, number, trials, timeout):
     problem_name = folder.strip("/").split("/")[-1]
     # print(problem_name)
-    domain = parse_file(os.path.join(folder, "domain.pddl"), "domain")
-    problems = sorted(os.path.join(folder,f) for f in os.listdir(folder) if PROBLEM_FILE_RE.match(f))[:number]
+    domain = parse_file(os.path.join(folder, "domain.pddl"), "domain", cache=PARSE_CACHE)
+    problem_files = sorted(os.path.join(folder,f) for f in os.listdir(folder) if PROBLEM_FILE_RE.match(f))[:number]
+    problems = parse_many(problem_files, domain, cache=PARSE_CACHE)
 
     for agent in AGENTS.values():
         agent.determinizer.set_domain(domain)
@@ -87,8 +90,7 @@ def main(folder, number, trials, timeout):
     results = {agname: [] for agname in AGENTS}
 
     for idx in trange(len(problems), desc="problem"):
-        pfile = problems[idx]
-        problem = parse_file(pfile, "problem", domain)
+        problem = problems[idx]
         simulator.reset(problem)
         agents = list(AGENTS.items())
         for jdx in trange(len(agents), desc="agent"):
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+
+"""
+Measures the memory taken by the nodes of the PDDL model (bytes per node,
+as reported by tracemalloc) and the total memory taken by binding every
+action of a problem and by its initial state.
+"""
+
+import os
+import sys
+import argparse
+import tracemalloc
+from itertools import product
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from planning_toolbox.parser import parse_file
+from planning_toolbox.pddl import *
+
+
+PROBLEMS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "problems", "pddl")
+
+NODES = {
+        "Object": lambda i: Object("o"+str(i)),
+        "ObjectList": lambda i: ObjectList(),
+        "Predicate": lambda i: Predicate("p", ObjectList()),
+        "PredicateQuery": lambda i: PredicateQuery(None),
+        "AndQuery": lambda i: AndQuery(),
+        "NotQuery": lambda i: NotQuery(None),
+        "AddEffect": lambda i: AddEffect(None),
+        "DeleteEffect": lambda i: DeleteEffect(None),
+        "AndEffect": lambda i: AndEffect(),
+        "SymbolicState": lambda i: SymbolicState(),
+}
+
+
+def measure(build, n):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = build(n)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objs
+    return after - before
+
+
+def bind_all(problem):
+    """ Binds every action with every tuple of objects (ignoring types) """
+    names = [obj.name for obj in problem.objects]
+    return [action.bind(dict(zip((p.name for p in action.parameters), args)))
+            for action in problem.domain.actions
+            for args in product(names, repeat=len(action.parameters))]
+
+
+def main(domain, problem, n):
+    print("{:<16}{:>12}".format("node", "bytes/node"))
+    # the containers created by each node (e.g. the list of AndQuery) are
+    # also accounted, since they are part of the node's footprint
+    for name, factory in NODES.items():
+        nbytes = measure(lambda n: [factory(i) for i in range(n)], n)
+        print("{:<16}{:>12.1f}".format(name, nbytes/n - 8)) # 8: list slot
+    domain = parse_file(os.path.join(PROBLEMS, domain))
+    problem = parse_file(os.path.join(PROBLEMS, problem), "problem", domain)
+    nbytes = measure(lambda n: bind_all(problem), None)
+    print("bound actions of {}: {:.2f} MiB".format(problem.name, nbytes/2**20))
+    problem.get_initial_state() # warm up any per-problem table
+    nbytes = measure(lambda n: problem.get_initial_state(), None)
+    print("initial state of {}: {:.2f} KiB".format(problem.name, nbytes/2**10))
+    problem.get_initial_state(packed=True)
+    nbytes = measure(lambda n: problem.get_initial_state(packed=True), None)
+    print("packed initial state of {}: {:.2f} KiB".format(problem.name, nbytes/2**10))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--domain", default="blocks/domain.pddl")
+    parser.add_argument("--problem", default="blocks/probBLOCKS-20-0.pddl")
+    parser.add_argument("-n", type=int, default=100000,
+            help="number of instances of each node")
+    args = parser.parse_args()
+    main(**vars(args))
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+
+"""
+Measures the cost of hashing the states of long simulated trajectories, as
+done by the agents when they look states up in their partial policies. The
+incremental (Zobrist) hash of SymbolicState is compared with hashing the
+frozenset of the state's atoms, which is linear in the size of the state.
+"""
+
+import os
+import sys
+import random
+import argparse
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from planning_toolbox.parser import parse_file
+
+
+PROBLEMS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "problems", "pddl")
+
+
+def simulate(problem, steps, seed):
+    """ Actions of a random walk of (at most) the given number of steps """
+    rng = random.Random(seed)
+    state = problem.get_initial_state()
+    actions = []
+    for _ in range(steps):
+        applicable = problem.applicable_actions(state)
+        if not applicable: break
+        actions.append(rng.choice(applicable))
+        state = actions[-1].apply(state)
+    return actions
+
+
+def replay(problem, actions, key):
+    """ Time taken to apply the actions from the initial state, looking every
+    state up in a table (as a policy would) if a key is given """
+    table = {}
+    state = problem.get_initial_state()
+    if key is not None: key(state)
+    start = perf_counter()
+    for action in actions:
+        state = action.apply(state)
+        if key is not None:
+            k = key(state)
+            table[k] = table.get(k, 0) + 1
+    return perf_counter() - start
+
+
+def main(domain, problem, steps, trajectories):
+    domain = parse_file(os.path.join(PROBLEMS, domain))
+    problem = parse_file(os.path.join(PROBLEMS, problem), "problem", domain)
+    walks = [simulate(problem, steps, seed) for seed in range(trajectories)]
+    nsteps = sum(len(actions) for actions in walks)
+    # the Zobrist hash of a state is kept up to date by the effects once it
+    # has been computed, so part of its cost is paid by apply(); states that
+    # are never hashed skip the update
+    keys = (("apply only", None),
+            ("frozenset", lambda s: frozenset(s.predicates)),
+            ("zobrist (incremental)", lambda s: s))
+    print("{} steps, {} atoms in the initial state".format(nsteps,
+        len(problem.init.predicates)))
+    print("{:<24}{:>14}{:>14}".format("hash", "us/step", "hash us/step"))
+    baseline = None
+    for name, key in keys:
+        elapsed = sum(replay(problem, actions, key) for actions in walks)
+        baseline = elapsed if baseline is None else baseline
+        print("{:<24}{:>14.2f}{:>14.2f}".format(name, 1e6*elapsed/nsteps,
+            1e6*(elapsed-baseline)/nsteps))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--domain", default="blocks/domain.pddl")
+    parser.add_argument("--problem", default="blocks/probBLOCKS-50-0.pddl")
+    parser.add_argument("--steps", type=int, default=1000,
+            help="length of each trajectory")
+    parser.add_argument("--trajectories", type=int, default=10)
+    args = parser.parse_args()
+    main(**vars(args))
@@ -1,7 +1,11 @@
+import time
+import random
+from math import log, sqrt
+
 from .determinization import AllOutcomeDeterminizer
 
 from .imagine.imagine_state import ImagineState
-from .pddl import SymbolicState, PredicateQuery, Predicate
+from .pddl import SymbolicState, PackedState, PredicateQuery, Predicate
 
 class Agent:
  
@@ -63,7 +67,7 @@ class SimpleDeterminizerAgent(Agent):
             if result["plan-found"]:
                 next_state = dproblem.get_initial_state()
                 for action in result["plan"]:
-                    action_outcome = dproblem.domain.retrieve_action(*action)
+                    action_outcome = dproblem.retrieve_action(*action)
                     _, _, base = self.determinizer.process_action_tuple(action)
                     self._partial_policy[next_state] = base
                     next_state = action_outcome.apply(next_state)
@@ -79,6 +83,39 @@ class SimpleDeterminizerAgent(Agent):
         self._partial_policy = {}
 
 
+class MDPAgent(Agent):
+    """ Agent that follows the policy computed in-process by an MDP solver
+    (see mdp.LRTDP and mdp.ILAOStar) over the ground probabilistic actions of
+    the problem. The solver is called again only from the states that the
+    policy does not cover, resuming from the values it computed before. The
+    policy is indexed by states packed with the atoms of the agent's problem """
+
+    def __init__(self, problem, solver):
+        self.problem = problem
+        self.solver = solver
+        self._partial_policy = None
+        self._ssp = None
+        self.invokations = 0
+
+    def _step(self, state, remaining):
+        key = PackedState(self.problem.intern_table.encode(state.predicates),
+                self.problem)
+        key.total_cost = state.total_cost
+        key.reward = state.reward
+        if key not in self._partial_policy:
+            # the problem is left untouched, so its grounding is reused
+            result = self.solver(self.problem, timeout=remaining, ssp=self._ssp,
+                    state=key)
+            self.invokations += 1
+            self._ssp = result["ssp"]
+            self._partial_policy.update(result["policy"])
+        return self._partial_policy.get(key)
+
+    def _reset(self):
+        self._partial_policy = {}
+        self._ssp = None
+
+
 class HindsightAgent(Agent):
    
     def __init__(self, problem, determinizer, planner, initial_calls=30,
@@ -130,7 +167,7 @@ class HindsightAgent(Agent):
             # remaining_invokations = self.calls_per_pha*len(pha)
             for a, plans in pha.items():
                 del plans[:]
-                action = self.problem.domain.retrieve_action(*a)
+                action = self.problem.retrieve_action(*a)
                 for idx in range(self.calls_per_pha):
                     determinizer = self.determinizer
                     # determinizer = self._aodeterminizer if idx == self.calls_per_pha - 1 else self.determinizer
@@ -227,6 +264,143 @@ class ImagineAgent(Agent):
         self.agent._reset()
 
 
+class UCTAgent(Agent):
+    """ Agent that chooses every action with UCT, a Monte Carlo tree search
+    over the ground operators of the problem that samples their outcomes
+    in-process (see Action.sample_successor). Every iteration descends the
+    tree, choosing actions by UCB1 on their mean cost until it reaches an
+    action that has not been tried, and estimates the cost of the new state
+    with a rollout of rollout_policy (a function (state, actions, rng) ->
+    action, by default random_rollout) up to the horizon. Actions cost their
+    increase of total-cost if the problem minimizes a metric and 1 otherwise,
+    and reaching a state without applicable actions costs dead_end.
+
+    The search is anytime: it runs until time_per_step seconds (at most the
+    remaining time of the simulation) or max_iterations iterations have
+    passed, and then executes the most visited action. When the observed
+    successor is already in the tree, the next search resumes from its
+    subtree """
+
+    def __init__(self, problem, rollout_policy=None, horizon=50,
+            time_per_step=1.0, max_iterations=None, exploration=1.0,
+            dead_end=500, seed=None):
+        self.problem = problem
+        self.rollout_policy = random_rollout if rollout_policy is None \
+                else rollout_policy
+        self.horizon = horizon
+        self.time_per_step = time_per_step
+        self.max_iterations = max_iterations
+        self.exploration = exploration
+        self.dead_end = dead_end
+        self.rng = random.Random(seed)
+        metric = problem.goal.metric
+        self.use_costs = bool(metric) and metric[0] == "minimize"
+        self._root = None
+        self._last = None
+        self.iterations = 0
+
+    def _step(self, state, remaining):
+        root = self._subtree(state)
+        deadline = time.time() + min(self.time_per_step, remaining)
+        iterations = 0
+        while (self.max_iterations is None or iterations < self.max_iterations) \
+                and time.time() < deadline:
+            self._search(root, 0)
+            iterations += 1
+        self.iterations += iterations
+        best = max(root.stats.items(), key=lambda item: item[1][0], default=None)
+        if best is None:
+            self._root = self._last = None
+            return None
+        self._root, self._last = root, best[0]
+        return best[0]
+
+    def _subtree(self, state):
+        """ Node of the observed state under the last action executed, or a
+        new tree if it was not sampled before """
+        if self._root is not None:
+            node = self._root.stats[self._last][2].get(state)
+            if node is not None: return node
+        return UCTNode(state)
+
+    def _cost(self, op, state):
+        return op.get_cost(state) if self.use_costs else 1
+
+    def _search(self, node, depth):
+        """ Cost of an iteration from the node, updating the statistics of the
+        nodes it goes through """
+        state = node.state
+        if self.problem.goal.is_satisfied(state): return 0
+        if depth >= self.horizon: return 0
+        if node.actions is None:
+            node.actions = {op.tuple_representation(): op
+                    for op in self.problem.applicable_actions(state)}
+        if not node.actions: return self.dead_end
+        untried = [a for a in node.actions if a not in node.stats]
+        if untried:
+            action = self.rng.choice(untried)
+            op = node.actions[action]
+            node.stats[action] = [0, 0.0, {}]
+            succ = op.sample_successor(state, self.rng)
+            cost = self._cost(op, state) + self._rollout(succ, depth+1)
+        else:
+            action = self._select(node)
+            op = node.actions[action]
+            succ = op.sample_successor(state, self.rng)
+            children = node.stats[action][2]
+            child = children.get(succ)
+            if child is None:
+                child = children[succ] = UCTNode(succ)
+            cost = self._cost(op, state) + self._search(child, depth+1)
+        stats = node.stats[action]
+        stats[0] += 1
+        stats[1] += (cost - stats[1]) / stats[0]
+        node.visits += 1
+        return cost
+
+    def _select(self, node):
+        """ Action that minimizes the UCB1 lower bound on its mean cost. The
+        exploration term is scaled by the mean cost of the node's actions """
+        log_visits = log(node.visits)
+        scale = self.exploration * max(1.0, max(abs(s[1]) for s in node.stats.values()))
+        return min(node.stats, key=lambda a: node.stats[a][1] -
+                scale*sqrt(log_visits/node.stats[a][0]))
+
+    def _rollout(self, state, depth):
+        total = 0
+        goal = self.problem.goal
+        while depth < self.horizon and not goal.is_satisfied(state):
+            actions = self.problem.applicable_actions(state)
+            if not actions: return total + self.dead_end
+            op = self.rollout_policy(state, actions, self.rng)
+            total += self._cost(op, state)
+            state = op.sample_successor(state, self.rng)
+            depth += 1
+        return total
+
+    def _reset(self):
+        self._root = None
+        self._last = None
+
+
+class UCTNode:
+    """ Decision node of the UCT tree. stats maps the actions tried in the
+    state to [visits, mean cost, {successor state: UCTNode}] """
+
+    __slots__ = ("state", "visits", "actions", "stats")
+
+    def __init__(self, state):
+        self.state = state
+        self.visits = 0
+        self.actions = None
+        self.stats = {}
+
+
+def random_rollout(state, actions, rng):
+    """ Rollout policy that chooses an applicable action uniformly at random """
+    return rng.choice(actions)
+
+
 def group_by_first_action(plans):
     grouped = {}
     for p in plans:
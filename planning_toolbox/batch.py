@@ -0,0 +1,317 @@
+from .pddl import *
+from .grounding import precondition_literals
+
+import numpy as np
+
+
+class BatchTask:
+    """ Vectorized view of the ground operators of a problem, used to evaluate
+    and advance many states at once (e.g. Monte Carlo rollouts). A batch of N
+    states is an N x F boolean matrix whose columns are the fact ids of the
+    problem's InternTable, so packed states convert directly.
+
+    Preconditions and goals are tested with one gather per literal of their
+    top level conjunction. Operators (and goals) that are not plain
+    conjunctions of literals are additionally checked with their compiled
+    queries, one state at a time, in the rows that pass the vectorized test.
+    Effects are expanded into their outcomes (see Action.outcomes), universal
+    effects are instantiated over the objects, and numeric effects are
+    ignored. Most outcomes reduce to the atoms they add and delete, which are
+    set with one scatter for all the rows; outcomes with conditional or nested
+    probabilistic effects are applied as a sequence of steps (see
+    outcome_literals) to all the rows that share them, testing the conditions
+    like preconditions and sampling the nested outcomes with the rng """
+
+    def __init__(self, problem, operators=None):
+        self.problem = problem
+        self.operators = list(problem.ground_operators() if operators is None
+                else operators)
+        self.index = {op.tuple_representation(): idx
+                for idx, op in enumerate(self.operators)}
+        table = problem.intern_table
+        for atom in problem.init.predicates:
+            table.fact_id(atom)
+        pre = [precondition_literals(op.precondition) for op in self.operators]
+        self.pre_pos, self.pre_pos_valid = self._literal_matrix([p for p,_,_ in pre])
+        self.pre_neg, self.pre_neg_valid = self._literal_matrix([n for _,n,_ in pre])
+        self.residual = np.array([not exact for _,_,exact in pre], dtype=bool)
+        # outcomes of all the operators, stored contiguously: the outcomes of
+        # operator i are first[i], ..., first[i]+noutcomes[i]-1
+        outcomes = [outcome_literals(problem, op) for op in self.operators]
+        self.noutcomes = np.array([len(o) for o in outcomes], dtype=np.int64)
+        self.first = np.concatenate(([0], np.cumsum(self.noutcomes)[:-1])).astype(np.int64)
+        # cumulative probabilities, padded with infinity so the sampled index
+        # never goes past the last outcome
+        self.cumprob = np.full((len(outcomes), max(self.noutcomes, default=1)), np.inf)
+        for idx, outcome in enumerate(outcomes):
+            self.cumprob[idx,:len(outcome)-1] = np.cumsum([p for p,_,_,_ in outcome])[:-1]
+        flat = [o for outcome in outcomes for o in outcome]
+        self.adds, self.adds_valid = self._literal_matrix([a for _,a,_,_ in flat])
+        self.deletes, self.deletes_valid = self._literal_matrix([d for _,_,d,_ in flat])
+        # steps of the outcomes that do not reduce to literals, by flat index
+        self.steps = {k: self._compile_steps(steps)
+                for k, (_,_,_,steps) in enumerate(flat) if steps is not None}
+        self.stepped = np.array(sorted(self.steps), dtype=np.int64)
+        self.deterministic = bool(np.all(self.noutcomes == 1))
+        goal = problem.goal.query
+        pos, neg, exact = precondition_literals(goal) if goal is not None \
+                else ([], [], True)
+        self.goal_pos = np.array([table.fact_id(a) for a in pos], dtype=np.int64)
+        self.goal_neg = np.array([table.fact_id(a) for a in neg], dtype=np.int64)
+        self.goal_residual = not exact
+        # every atom that may appear in a state has an id by now
+        self.nfacts = len(table.facts)
+
+    def _literal_matrix(self, literals):
+        """ Rows of fact ids (padded with 0) and the mask of the valid ones """
+        fact_id = self.problem.intern_table.fact_id
+        width = max((len(l) for l in literals), default=0)
+        ids = np.zeros((len(literals), width), dtype=np.int64)
+        valid = np.zeros((len(literals), width), dtype=bool)
+        for row, atoms in enumerate(literals):
+            ids[row,:len(atoms)] = [fact_id(a) for a in atoms]
+            valid[row,:len(atoms)] = True
+        return ids, valid
+
+    def _compile_steps(self, steps):
+        """ Steps of an outcome (see outcome_literals) with fact ids. The
+        condition of a "when" step becomes the arrays of its positive and
+        negative literals and, if it is not a plain conjunction of them, the
+        query to check in the rows that pass; conditions that never hold
+        drop their step """
+        fact_id = self.problem.intern_table.fact_id
+        ids = lambda atoms: np.array([fact_id(a) for a in atoms], dtype=np.int64)
+        compiled = []
+        for step in steps:
+            if step[0] == "literals":
+                values = step[1]
+                compiled.append(("literals", ids(a for a, v in values.items() if v),
+                    ids(a for a, v in values.items() if not v)))
+            elif step[0] == "when":
+                literals = condition_literals(step[1])
+                if literals is None: continue
+                pos, neg, exact = literals
+                compiled.append(("when", ids(pos), ids(neg),
+                    None if exact else step[1], self._compile_steps(step[2])))
+            else:
+                cumprob = np.cumsum([p for p, _ in step[1]])
+                compiled.append(("probabilistic", cumprob,
+                    [self._compile_steps(sub) for _, sub in step[1]]))
+        return compiled
+
+    def operator_index(self, action):
+        """ Index of an operator, given as a tuple (name, *args) or as the
+        operator itself """
+        if not isinstance(action, tuple):
+            action = action.tuple_representation()
+        return self.index[action]
+
+    def encode(self, states):
+        """ N x F boolean matrix with the given states (symbolic or packed) """
+        table = self.problem.intern_table
+        nbytes = (self.nfacts+7)//8
+        matrix = np.zeros((len(states), self.nfacts), dtype=bool)
+        for row, state in enumerate(states):
+            bits = state.bits if isinstance(state, PackedState) \
+                    else table.encode(state.predicates)
+            matrix[row] = np.unpackbits(np.frombuffer(bits.to_bytes(nbytes, "little"),
+                dtype=np.uint8), bitorder="little")[:self.nfacts]
+        return matrix
+
+    def decode(self, row, packed=False):
+        """ State (a SymbolicState, or a PackedState if packed is True) with
+        the atoms of a row of a batch """
+        facts = self.problem.intern_table.facts
+        atoms = [facts[fid] for fid in np.flatnonzero(row)]
+        if packed:
+            return PackedState(self.problem.intern_table.encode(atoms), self.problem)
+        return SymbolicState(atoms, None, self.problem)
+
+    def initial_states(self, n):
+        """ Batch with n copies of the initial state """
+        return np.repeat(self.encode([self.problem.get_initial_state()]), n, axis=0)
+
+    def applicable(self, states, operators=None):
+        """ N x |operators| boolean matrix whose element (i, j) tells whether
+        the j-th operator (by default, all of them) is applicable in the i-th
+        state. Operators can be given as an array of indices """
+        if operators is None:
+            operators = np.arange(len(self.operators))
+        operators = np.asarray(operators, dtype=np.int64)
+        result = np.ones((len(states), len(operators)), dtype=bool)
+        pos, pos_valid = self.pre_pos[operators], self.pre_pos_valid[operators]
+        for k in range(pos.shape[1]):
+            result &= states[:,pos[:,k]] | ~pos_valid[:,k]
+        neg, neg_valid = self.pre_neg[operators], self.pre_neg_valid[operators]
+        for k in range(neg.shape[1]):
+            result &= ~(states[:,neg[:,k]] & neg_valid[:,k])
+        residual = np.flatnonzero(self.residual[operators])
+        if len(residual):
+            rows, cols = np.nonzero(result[:,residual])
+            decoded = {}
+            for row, col in zip(rows, cols):
+                state = decoded.get(row)
+                if state is None:
+                    state = decoded[row] = self.decode(states[row])
+                op = self.operators[operators[residual[col]]]
+                result[row,residual[col]] = op.is_applicable(state)
+        return result
+
+    def sample_applicable(self, states, rng=None):
+        """ Index of an operator chosen uniformly at random among the ones that
+        are applicable in each state, or -1 if there is none """
+        rng = np.random.default_rng() if rng is None else rng
+        scores = rng.random((len(states), len(self.operators)))
+        scores[~self.applicable(states)] = -1.0
+        choice = np.argmax(scores, axis=1) if len(self.operators) else \
+                np.zeros(len(states), dtype=np.int64)
+        choice[scores[np.arange(len(states)),choice] < 0] = -1
+        return choice
+
+    def apply(self, states, operators, rng=None):
+        """ New batch in which the i-th state is the result of applying the
+        i-th operator (an index; negative means no-op) to it. The outcome of
+        probabilistic operators is sampled with the given numpy Generator.
+        Applicability is not checked """
+        operators = np.asarray(operators, dtype=np.int64)
+        rows = np.flatnonzero(operators >= 0)
+        ops = operators[rows]
+        outcomes = self.first[ops]
+        rng = np.random.default_rng() if rng is None else rng
+        if not self.deterministic:
+            u = rng.random(len(ops))
+            outcomes = outcomes + np.sum(u[:,None] >= self.cumprob[ops], axis=1)
+        result = states.copy()
+        for ids, valid, value in ((self.deletes, self.deletes_valid, False),
+                (self.adds, self.adds_valid, True)):
+            ids, valid = ids[outcomes], valid[outcomes]
+            r = np.broadcast_to(rows[:,None], ids.shape)
+            result[r[valid],ids[valid]] = value
+        if len(self.stepped):
+            decoded = {}
+            for k in np.intersect1d(outcomes, self.stepped):
+                self._apply_steps(self.steps[k], states, result,
+                        rows[outcomes == k], rng, decoded)
+        return result
+
+    def _apply_steps(self, steps, states, result, rows, rng, decoded):
+        """ Applies compiled steps to the given rows of result, testing the
+        conditions in states (the batch before the transition, as in
+        ConditionalEffect.apply). decoded caches the decoded rows """
+        for step in steps:
+            if not len(rows): return
+            if step[0] == "literals":
+                _, adds, deletes = step
+                result[np.ix_(rows, deletes)] = False
+                result[np.ix_(rows, adds)] = True
+            elif step[0] == "when":
+                _, pos, neg, query, sub = step
+                holds = states[np.ix_(rows, pos)].all(axis=1) & \
+                        ~states[np.ix_(rows, neg)].any(axis=1)
+                if query is not None:
+                    for i in np.flatnonzero(holds):
+                        state = decoded.get(rows[i])
+                        if state is None:
+                            state = decoded[rows[i]] = self.decode(states[rows[i]])
+                        holds[i] = query.eval(state)
+                self._apply_steps(sub, states, result, rows[holds], rng, decoded)
+            else:
+                _, cumprob, subs = step
+                # index len(subs) when no nested outcome occurs
+                branch = np.searchsorted(cumprob, rng.random(len(rows)), side="right")
+                for b, sub in enumerate(subs):
+                    self._apply_steps(sub, states, result, rows[branch == b], rng, decoded)
+
+    def goal_reached(self, states):
+        """ Boolean vector telling which states satisfy the goal """
+        result = states[:,self.goal_pos].all(axis=1) & \
+                ~states[:,self.goal_neg].any(axis=1)
+        if self.goal_residual:
+            for row in np.flatnonzero(result):
+                result[row] = self.problem.goal.is_satisfied(self.decode(states[row]))
+        return result
+
+    def plan_probability(self, plan, samples=1000, rng=None):
+        """ Monte Carlo estimate of the probability that executing the plan (a
+        sequence of operators or of (name, *args) tuples) from the initial
+        state reaches the goal. Trajectories in which an action is not
+        applicable fail """
+        rng = np.random.default_rng() if rng is None else rng
+        states = self.initial_states(samples)
+        alive = np.ones(samples, dtype=bool)
+        for action in plan:
+            idx = self.operator_index(action)
+            alive &= self.applicable(states, [idx])[:,0]
+            states = self.apply(states, np.where(alive, idx, -1), rng)
+        return float(np.mean(alive & self.goal_reached(states)))
+
+
+def outcome_literals(problem, action):
+    """ List of (probability, added atoms, deleted atoms, steps) with the
+    outcomes of a ground action (see Action.outcomes). Universal effects are
+    instantiated over the objects. When an atom is both added and deleted by
+    an outcome, the last effect wins, as in AndEffect.apply.
+
+    steps is None for the outcomes that reduce to literals. The other ones
+    (with conditional effects, or probabilistic effects nested in universal
+    or conditional ones) add and delete no atoms, and steps lists their
+    effects in order: ("literals", {atom: value}), ("when", condition,
+    steps) and ("probabilistic", [(probability, steps), ...]) """
+    outcomes = []
+    for p, e in action.outcomes():
+        steps = effect_steps(problem, e, [])
+        if all(step[0] == "literals" for step in steps):
+            values = steps[0][1] if steps else {}
+            outcomes.append((p, [a for a, v in values.items() if v],
+                [a for a, v in values.items() if not v], None))
+        else:
+            outcomes.append((p, [], [], steps))
+    return outcomes
+
+
+def effect_steps(problem, effect, steps):
+    """ Appends the steps of a ground effect (see outcome_literals) to a
+    list, merging consecutive literals, and returns it """
+    if isinstance(effect, AndEffect):
+        for e in effect.effects:
+            effect_steps(problem, e, steps)
+    elif isinstance(effect, (AddEffect, DeleteEffect)):
+        if not steps or steps[-1][0] != "literals":
+            steps.append(("literals", {}))
+        if isinstance(effect, AddEffect):
+            steps[-1][1][effect.add] = True
+        else:
+            steps[-1][1][effect.delete] = False
+    elif isinstance(effect, ForallEffect):
+        table = problem.intern_table
+        for sigma in all_possible_assignments(problem, effect.parameters):
+            effect_steps(problem, effect.effect.bind(sigma, table), steps)
+    elif isinstance(effect, ConditionalEffect):
+        steps.append(("when", effect.lhs, effect_steps(problem, effect.rhs, [])))
+    elif isinstance(effect, ProbabilisticEffect):
+        steps.append(("probabilistic", [(p, effect_steps(problem, e, []))
+            for p, e in effect.effects]))
+    elif not isinstance(effect, (EmptyEffect, AssignmentEffect)):
+        raise NotImplementedError("Batched transitions do not support " +
+                type(effect).__name__)
+    return steps
+
+
+def condition_literals(query):
+    """ precondition_literals of a ground condition, with its top level
+    (in)equalities evaluated, or None if one of them is false """
+    if isinstance(query, AndQuery):
+        positive, negative, exact = [], [], True
+        for q in query.queries:
+            literals = condition_literals(q)
+            if literals is None: return None
+            positive += literals[0]
+            negative += literals[1]
+            exact = exact and literals[2]
+        return positive, negative, exact
+    negated = isinstance(query, NotQuery)
+    atom = query.negated if negated else query
+    if isinstance(atom, PredicateQuery) and atom.predicate.name == "=":
+        lhs, rhs = atom.predicate.arguments
+        return ([], [], True) if (lhs == rhs) != negated else None
+    return precondition_literals(query)
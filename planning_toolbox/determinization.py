@@ -119,7 +119,7 @@ class AlphaCostLikelihoodDeterminizer(Determinizer):
 
     def determinize_domain(self, domain):
         domain.remove_mdp_requirements()
-        if "total-cost" not in (f.name for f in domain.functions):
+        if not domain.is_function("total-cost"):
             domain.functions.append(Function("total-cost"))
         actions = []
         for a in domain.actions:
@@ -128,7 +128,7 @@ class AlphaCostLikelihoodDeterminizer(Determinizer):
                 if e.is_empty() or p < 1e-6: continue
                 anew = a.copy()
                 anew.name = anew.name + "_o" + str(idx)
-                anew.effect = e.copy().transform_rewards_to_costs(
+                anew.effect = e.transform_rewards_to_costs(
                         self.alpha, round_=self.round_)
                 offset = self.base - log(p)
                 if self.round_ > 0: offset = int(round(offset*10**self.round_))
@@ -161,7 +161,7 @@ class HindsightDeterminizer(Determinizer):
     def _determinize_domain_global(self, domain):
         domain.remove_mdp_requirements()
         if self.transform_rewards:
-            if "total-cost" not in (f.name for f in domain.functions):
+            if not domain.is_function("total-cost"):
                 domain.functions.append(Function("total-cost"))
         else: domain.remove_reward_assignments()
         domain.type_hierarchy["timestep"] = None
@@ -174,11 +174,11 @@ class HindsightDeterminizer(Determinizer):
                 if p < 1e-6: continue
                 anew = a.copy()
                 anew.name += "_o" + str(idx)
-                anew.effect = e.copy()
+                anew.effect = e
                 if self.transform_rewards:
                     anew.effect = anew.effect.transform_rewards_to_costs()
-                anew.parameters.objects.append(Object("?tn_1", "timestep"))
-                anew.parameters.objects.append(Object("?tn", "timestep"))
+                anew.parameters = ObjectList(*anew.parameters,
+                        Object("?tn_1", "timestep"), Object("?tn", "timestep"))
                 new_queries = [
                         PredicateQuery(Predicate("current_timestep", "?tn_1")),
                         PredicateQuery(Predicate("next_timestep", "?tn_1", "?tn")),
@@ -191,12 +191,14 @@ class HindsightDeterminizer(Determinizer):
                         DeleteEffect(Predicate("current_timestep", "?tn_1")),
                         AddEffect(Predicate("current_timestep", "?tn")),
                 ]
+                # the precondition and the effect are shared with the original
+                # action, so they are extended into new ones
                 if isinstance(anew.precondition, AndQuery):
-                    anew.precondition.queries += new_queries
+                    anew.precondition = AndQuery(*anew.precondition.queries, *new_queries)
                 else:
                     anew.precondition = AndQuery(anew.precondition, *new_queries)
                 if isinstance(anew.effect, AndEffect):
-                    anew.effect.effects += new_effects
+                    anew.effect = AndEffect(*anew.effect.effects, *new_effects)
                 else:
                     anew.effect = AndEffect(anew.effect, *new_effects)
                 anew.effect = anew.effect.simplify()
@@ -207,7 +209,7 @@ class HindsightDeterminizer(Determinizer):
     def _determinize_domain_local(self, domain):
         domain.remove_mdp_requirements()
         if self.transform_rewards:
-            if "total-cost" not in (f.name for f in domain.functions):
+            if not domain.is_function("total-cost"):
                 domain.functions.append(Function("total-cost"))
         else: domain.remove_reward_assignments()
         domain.type_hierarchy["status"] = None
@@ -221,12 +223,12 @@ class HindsightDeterminizer(Determinizer):
                 if p < 1e-6: continue
                 anew = a.copy()
                 anew.name += "_o" + str(idx)
-                anew.effect = e.copy()
+                anew.effect = e
                 if self.transform_rewards:
                     anew.effect = anew.effect.transform_rewards_to_costs()
                 if len(a.effect) > 1:
-                    anew.parameters.objects.append(Object("?sn_1", "status"))
-                    anew.parameters.objects.append(Object("?sn", "status"))
+                    anew.parameters = ObjectList(*anew.parameters,
+                            Object("?sn_1", "status"), Object("?sn", "status"))
                     domain.predicates.append(Predicate("applicable_"+anew.name, ("?s", "status")))
                     new_queries = [
                             PredicateQuery(Predicate("status_"+a.name, "?sn_1")),
@@ -238,11 +240,11 @@ class HindsightDeterminizer(Determinizer):
                             AddEffect(Predicate("status_"+a.name, "?sn")),
                     ]
                     if isinstance(anew.precondition, AndQuery):
-                        anew.precondition.queries += new_queries
+                        anew.precondition = AndQuery(*anew.precondition.queries, *new_queries)
                     else:
                         anew.precondition = AndQuery(anew.precondition, *new_queries)
                     if isinstance(anew.effect, AndEffect):
-                        anew.effect.effects += new_effects
+                        anew.effect = AndEffect(*anew.effect.effects, *new_effects)
                     else:
                         anew.effect = AndEffect(anew.effect, *new_effects)
                 anew.effect = anew.effect.simplify()
@@ -309,12 +311,9 @@ class HindsightDeterminizer(Determinizer):
 
 def sample_outcome(action):
     # return action.name+"_o{}".format(random.randrange(len(action.effect)))
-    r = random.random()
-    acc = 0
-    for idx, (p,e) in enumerate(action.effect):
-        acc += p
-        if r < acc:
-            return action.name + "_o{}".format(idx)
-    return action.name + "_o{}".format(len(action.effect)-1)
+    idx = action.effect.sample_index()
+    if idx is None:
+        idx = len(action.effect)-1
+    return action.name + "_o{}".format(idx)
 
 
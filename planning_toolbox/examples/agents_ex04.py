@@ -0,0 +1,26 @@
+import argparse
+from ..parser import parse_file
+from ..mdp import *
+from ..simulation import *
+from ..agents import *
+
+
+def main(filepath, solver):
+    sdomain, sproblem = parse_file(filepath, "both")
+    print(sdomain)
+    print(sproblem)
+
+    if solver == "lrtdp": solver = LRTDP(seed=0)
+    else: solver = ILAOStar()
+    simulator = PpddlSimulator(sproblem)
+    agent = MDPAgent(sproblem.copy(), solver)
+    agent(simulator, verbose=True)
+    print(agent.invokations)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filepath", help="Filepath to LISP-like text file")
+    parser.add_argument("-s", "--solver", help="MDP solver", choices=["lrtdp", "ilao"],
+            default="lrtdp")
+    args = parser.parse_args()
+    main(**vars(args))
@@ -0,0 +1,26 @@
+import argparse
+from ..parser import parse_file
+from ..simulation import *
+from ..agents import *
+
+
+def main(filepath, time_per_step, horizon):
+    sdomain, sproblem = parse_file(filepath, "both")
+    print(sdomain)
+    print(sproblem)
+
+    simulator = PpddlSimulator(sproblem)
+    agent = UCTAgent(sproblem.copy(), horizon=horizon,
+            time_per_step=time_per_step, seed=0)
+    agent(simulator, verbose=True)
+    print(agent.iterations)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filepath", help="Filepath to LISP-like text file")
+    parser.add_argument("-t", "--time-per-step", help="Seconds of search per step",
+            type=float, default=1.0)
+    parser.add_argument("--horizon", help="Depth of the search and the rollouts",
+            type=int, default=50)
+    args = parser.parse_args()
+    main(**vars(args))
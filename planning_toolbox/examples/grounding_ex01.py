@@ -0,0 +1,25 @@
+import argparse
+from ..parser import *
+from ..grounding import *
+
+
+def main(domain, problem, verbose):
+    domain = parse_file(domain)
+    problem = parse_file(problem, "problem", domain)
+    grounder = Grounder(problem)
+    grounder.ground()
+    if verbose:
+        for op in grounder.operators:
+            print(op.short_str())
+    for key, value in grounder.stats.items():
+        print("{}: {}".format(key, value))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("domain", help="Filepath to the PDDL domain")
+    parser.add_argument("problem", help="Filepath to the PDDL problem")
+    parser.add_argument("-v", "--verbose", action="store_true",
+            help="Print the reachable ground operators")
+    args = parser.parse_args()
+    main(**vars(args))
@@ -9,7 +9,9 @@ def main(domainpath, problempath, planner, time_out):
     problem = parse_file(problempath, "problem", domain)
     print(domain)
     print(problem)
-    planner = FFPlanner(s=0) if planner == "ff" else FDPlanner(search="astar(add())")
+    if planner == "ff": planner = FFPlanner(s=0)
+    elif planner == "fd": planner = FDPlanner(search="astar(add())")
+    else: planner = SearchPlanner("gbfs")
     result = planner(problem, timeout=time_out)
     print("Plan found!" if result["plan-found"] else "Plan not found")
     if result["plan-found"]:
@@ -19,7 +21,7 @@ def main(domainpath, problempath, planner, time_out):
         print("Total elapsed: " + str(result["total-elapsed"]))
     elif result["timeout"]:
         print("timeout")
-    else:
+    elif "stdout" in result:
         print(result["stdout"])
         print(result["stderr"])
     print("wall time: {}s".format(result["time-wall"]))
@@ -29,8 +31,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("domainpath", help="Filepath to LISP-like text file")
     parser.add_argument("problempath", help="Filepath to LISP-like text file")
-    parser.add_argument("-t", "--time-out", help="Time before aborting")
-    parser.add_argument("-p", "--planner", help="Planner name", choices=["ff", "fd"],
+    parser.add_argument("-t", "--time-out", type=float, help="Time before aborting")
+    parser.add_argument("-p", "--planner", help="Planner name", choices=["ff", "fd", "search"],
             default="ff")
     args = parser.parse_args()
     print(args)
@@ -0,0 +1,397 @@
+from .pddl import *
+
+from collections import deque
+from itertools import product
+
+import time
+
+
+class Grounder:
+    """ Grounds the actions of a problem by delete-relaxed reachability. Atoms
+    are reached starting from the initial state; every time an atom is reached,
+    it is joined with the atoms reached so far to find the bindings of the
+    actions whose positive preconditions become true, and the add effects of
+    those bindings are reached in turn. Static predicates are never added, so
+    they only match atoms of the initial state and act as filters.
+
+    Only the positive atoms (and equalities) at the top level of each
+    precondition are used, so the result is a superset of the ground operators
+    that are applicable in some reachable state. The preconditions of the
+    operators are then specialized with the problem's StaticFacts, and the
+    operators whose preconditions can never hold are pruned. Operators are
+    returned in the same order in which all_possible_assignments enumerates
+    them """
+
+    def __init__(self, problem):
+        self.problem = problem
+        self.operators = None
+        self.stats = {"candidates": 0, "operators": 0, "pruned": 0, "atoms": 0,
+                "time": 0.0}
+        self._by_tuple = None
+
+    def ground(self):
+        start = time.perf_counter()
+        problem = self.problem
+        facts = problem.static_facts()
+        static = facts.predicates
+        schemas = [ActionSchema(problem, action, static)
+                for action in problem.domain.actions]
+        triggers = {}
+        for schema in schemas:
+            for idx, (name, _) in enumerate(schema.conjuncts):
+                triggers.setdefault(name, []).append((schema, idx))
+        self.reached = set()
+        self.index = {}
+        self.queue = deque()
+        for p in problem.init.predicates:
+            self.reach((p.name, *(o.name for o in p.arguments)))
+        for schema in schemas:
+            if not schema.conjuncts:
+                self.fire(schema, {})
+        while self.queue:
+            atom = self.queue.popleft()
+            for schema, idx in triggers.get(atom[0], ()):
+                sigma = schema.unify(idx, atom, {})
+                if sigma is not None:
+                    self.join(schema, sigma, [c for i, c in
+                        enumerate(schema.conjuncts) if i != idx])
+        table = problem.intern_table
+        self.operators = []
+        pruned = 0
+        for schema in schemas:
+            for values in sorted(schema.bindings, key=schema.order):
+                sigma = dict(zip(schema.variables, values))
+                op = schema.action.bind(sigma, table)
+                precondition = facts.specialize(op.precondition)
+                if precondition is False:
+                    pruned += 1
+                    continue
+                op.precondition = EmptyQuery() if precondition is True else precondition
+                self.operators.append(op)
+        self._by_tuple = None
+        self.stats["candidates"] = sum(s.candidates for s in schemas)
+        self.stats["operators"] = len(self.operators)
+        self.stats["pruned"] = pruned
+        self.stats["atoms"] = len(self.reached)
+        self.stats["time"] = time.perf_counter() - start
+        del self.reached, self.index, self.queue
+        return self.operators
+
+    def operator(self, name, *args):
+        """ Ground operator with the given name and arguments, or None """
+        if self._by_tuple is None:
+            self._by_tuple = {op.tuple_representation(): op for op in self.operators}
+        return self._by_tuple.get((name, *args))
+
+    def reach(self, atom):
+        if atom not in self.reached:
+            self.reached.add(atom)
+            self.queue.append(atom)
+            args = atom[1:]
+            index = self.index.setdefault(atom[0], {None: []})
+            index[None].append(args)
+            for pos, value in enumerate(args):
+                index.setdefault((pos, value), []).append(args)
+
+    def candidates(self, name, args, sigma):
+        """ Reached argument tuples of the given predicate that may match args
+        under the partial assignment sigma """
+        index = self.index.get(name)
+        if index is None: return ()
+        for pos, arg in enumerate(args):
+            value = sigma.get(arg, arg) if arg[0] == "?" else arg
+            if value[0] != "?":
+                return index.get((pos, value), ())
+        return index[None]
+
+    def join(self, schema, sigma, remaining):
+        if not remaining:
+            self.fire(schema, sigma)
+            return
+        # static conjuncts first, then the most constrained one
+        best = min(range(len(remaining)),
+                key=lambda i: (remaining[i][0] not in schema.static,
+                    -sum(a in sigma or a[0] != "?" for a in remaining[i][1])))
+        name, args = remaining[best]
+        rest = remaining[:best] + remaining[best+1:]
+        for values in self.candidates(name, args, sigma):
+            extended = schema.match(args, values, sigma)
+            if extended is not None:
+                self.join(schema, extended, rest)
+
+    def fire(self, schema, sigma):
+        free = [v for v in schema.variables if v not in sigma]
+        domains = [schema.domains[v] for v in free]
+        for values in product(*domains):
+            full = sigma.copy()
+            full.update(zip(free, values))
+            schema.candidates += 1
+            key = tuple(full[v] for v in schema.variables)
+            if key in schema.bindings or not schema.admits(full):
+                continue
+            schema.bindings.add(key)
+            for atom in schema.added_atoms(full):
+                self.reach(atom)
+
+
+class ActionSchema:
+    """ Lifted action prepared for grounding: the positive atoms and the
+    (in)equalities of its precondition, its add effects and the objects that
+    each parameter may take """
+
+    def __init__(self, problem, action, static):
+        self.problem = problem
+        self.action = action
+        self.static = static
+        self.variables = [p.name for p in action.parameters]
+        self.domains = {p.name: problem.all_objects_of_type(p.type)
+                for p in action.parameters}
+        self.positions = {v: {o: i for i, o in enumerate(objs)}
+                for v, objs in self.domains.items()}
+        self.conjuncts = []
+        self.equal = []
+        self.different = []
+        self.collect_precondition(action.precondition)
+        self.adds = []
+        self.collect_adds(action.effect, [])
+        self.bindings = set()
+        self.candidates = 0
+
+    def collect_precondition(self, query):
+        if isinstance(query, AndQuery):
+            for q in query.queries:
+                self.collect_precondition(q)
+        elif isinstance(query, PredicateQuery):
+            args = tuple(o.name for o in query.predicate.arguments)
+            # atoms with variables that are not parameters of the action
+            # cannot be joined, so they are ignored
+            if any(a[0] == "?" and a not in self.domains for a in args):
+                return
+            if query.predicate.name == "=":
+                self.equal.append(args)
+            else:
+                self.conjuncts.append((query.predicate.name, args))
+        elif isinstance(query, NotQuery) and isinstance(query.negated, PredicateQuery):
+            predicate = query.negated.predicate
+            args = tuple(o.name for o in predicate.arguments)
+            if predicate.name == "=" and all(a[0] != "?" or a in self.domains for a in args):
+                self.different.append(args)
+
+    def collect_adds(self, effect, quantified):
+        if isinstance(effect, AddEffect):
+            names = [p.name for p in quantified]
+            domains = [self.problem.all_objects_of_type(p.type) for p in quantified]
+            self.adds.append((names, domains, effect.add))
+        elif isinstance(effect, AndEffect):
+            for e in effect.effects:
+                self.collect_adds(e, quantified)
+        elif isinstance(effect, ForallEffect):
+            self.collect_adds(effect.effect, quantified + list(effect.parameters))
+        elif isinstance(effect, ConditionalEffect):
+            self.collect_adds(effect.rhs, quantified)
+        elif isinstance(effect, ProbabilisticEffect):
+            for _, e in effect.effects:
+                self.collect_adds(e, quantified)
+
+    def unify(self, idx, atom, sigma):
+        return self.match(self.conjuncts[idx][1], atom[1:], sigma)
+
+    def match(self, args, values, sigma):
+        """ Extends sigma so args match values, or returns None if they do not
+        match or a value is not of the type of its parameter """
+        extended = None
+        for arg, value in zip(args, values):
+            if arg[0] != "?":
+                if arg != value: return None
+                continue
+            bound = (extended or sigma).get(arg)
+            if bound is None:
+                if value not in self.positions[arg]: return None
+                if extended is None: extended = sigma.copy()
+                extended[arg] = value
+            elif bound != value:
+                return None
+        return sigma.copy() if extended is None else extended
+
+    def admits(self, sigma):
+        value = lambda a: sigma.get(a, a)
+        return all(value(a) == value(b) for a, b in self.equal) and \
+                all(value(a) != value(b) for a, b in self.different)
+
+    def added_atoms(self, sigma):
+        for names, domains, predicate in self.adds:
+            for values in product(*domains):
+                full = sigma.copy()
+                full.update(zip(names, values))
+                yield (predicate.name,
+                        *(full.get(o.name, o.name) for o in predicate.arguments))
+
+    def order(self, values):
+        return tuple(self.positions[v][o] for v, o in zip(self.variables, values))
+
+
+class StaticFacts:
+    """ Predicates and functions that no action modifies, along with their
+    values in the initial state of a problem. Since they keep these values in
+    every reachable state, the ground parts of a query that only depend on
+    them can be evaluated once (see specialize) """
+
+    def __init__(self, problem):
+        domain = problem.domain
+        self.predicates = set(p.name for p in domain.get_static_predicates())
+        # total-cost is stored in the state even if no action increases it
+        self.functions = set(f.name for f in domain.get_static_functions()
+                if f.name != "total-cost")
+        self.atoms = set(p for p in problem.init.predicates
+                if p.name in self.predicates)
+        self.values = {f: v for f, v in problem.init.functions.items()
+                if f.name in self.functions}
+
+    def specialize(self, query):
+        """ Partial evaluation of a query: True or False if its value only
+        depends on static facts, or otherwise the query with its static
+        subqueries evaluated and removed """
+        if isinstance(query, EmptyQuery):
+            return True
+        if isinstance(query, PredicateQuery):
+            predicate = query.predicate
+            if not predicate.is_ground():
+                return query
+            if predicate.name == "=":
+                return predicate.arguments[0] == predicate.arguments[1]
+            if predicate.name in self.predicates:
+                return predicate in self.atoms
+            return query
+        if isinstance(query, ComparisonQuery):
+            try:
+                lhs = self.value(query.lhs)
+                rhs = self.value(query.rhs)
+            except KeyError:
+                return query
+            return ComparisonQuery.FUNCTIONS[query.comparison](lhs, rhs)
+        if isinstance(query, NotQuery):
+            negated = self.specialize(query.negated)
+            if isinstance(negated, bool): return not negated
+            return query if negated is query.negated else NotQuery(negated)
+        if isinstance(query, (AndQuery, OrQuery)):
+            # absorbing element: False for and, True for or
+            absorbing = isinstance(query, OrQuery)
+            queries = []
+            for q in query.queries:
+                q_ = self.specialize(q)
+                if q_ is absorbing: return absorbing
+                if q_ is not (not absorbing): queries.append(q_)
+            if not queries: return not absorbing
+            if len(queries) == 1: return queries[0]
+            if len(queries) == len(query.queries) and \
+                    all(a is b for a, b in zip(queries, query.queries)):
+                return query
+            return type(query)(*queries)
+        if isinstance(query, ImplyQuery):
+            lhs = self.specialize(query.lhs)
+            rhs = self.specialize(query.rhs)
+            if lhs is False or rhs is True: return True
+            if lhs is True: return rhs
+            if rhs is False: return NotQuery(lhs)
+            if lhs is query.lhs and rhs is query.rhs: return query
+            return ImplyQuery(lhs, rhs)
+        return query
+
+    def value(self, query):
+        """ Value of a numeric query that only depends on static functions.
+        Raises KeyError otherwise """
+        if isinstance(query, Constant):
+            return query.constant
+        if isinstance(query, FunctionQuery):
+            if query.function.name not in self.functions or \
+                    not query.function.is_ground():
+                raise KeyError(query.function)
+            return self.values[query.function]
+        if isinstance(query, ArithmeticQuery):
+            return ArithmeticQuery.FUNCTIONS[query.operator](
+                    self.value(query.lhs), self.value(query.rhs))
+        raise KeyError(query)
+
+
+class SuccessorGenerator:
+    """ Inverted index from the atoms in the preconditions of the ground
+    operators to the operators. The operators applicable in a state are found
+    by counting, for each operator, how many of its precondition atoms are
+    true in the state, so only the operators that share atoms with the state
+    are visited. Operators whose preconditions are not plain conjunctions of
+    atoms are checked with their compiled preconditions once all their atoms
+    are matched """
+
+    def __init__(self, operators):
+        self.operators = list(operators)
+        self.index = {}
+        self.required = []
+        self.residual = []
+        self.unconditioned = []
+        for idx, op in enumerate(self.operators):
+            atoms, exact = precondition_atoms(op.precondition)
+            atoms = set(atoms)
+            for atom in atoms:
+                self.index.setdefault(atom, []).append(idx)
+            self.required.append(len(atoms))
+            self.residual.append(not exact)
+            if not atoms:
+                self.unconditioned.append(idx)
+
+    def applicable(self, state):
+        """ Operators applicable in the state, in the order of the operators
+        given to the constructor """
+        index = self.index
+        required = self.required
+        counters = {}
+        matched = self.unconditioned.copy()
+        for atom in state.predicates:
+            for idx in index.get(atom, ()):
+                count = counters.get(idx, 0) + 1
+                counters[idx] = count
+                if count == required[idx]:
+                    matched.append(idx)
+        matched.sort()
+        operators = self.operators
+        residual = self.residual
+        return [operators[idx] for idx in matched
+                if not residual[idx] or operators[idx].is_applicable(state)]
+
+
+def precondition_atoms(query):
+    """ Atoms in the top level conjunction of a ground query, and whether the
+    query is exactly the conjunction of those atoms """
+    if isinstance(query, EmptyQuery):
+        return [], True
+    if isinstance(query, PredicateQuery) and query.predicate.name != "=":
+        return [query.predicate], True
+    if isinstance(query, AndQuery):
+        atoms = []
+        exact = True
+        for q in query.queries:
+            sub_atoms, sub_exact = precondition_atoms(q)
+            atoms += sub_atoms
+            exact = exact and sub_exact
+        return atoms, exact
+    return [], False
+
+
+def precondition_literals(query):
+    """ Positive and negative atoms in the top level conjunction of a ground
+    query, and whether the query is exactly the conjunction of those
+    literals """
+    if isinstance(query, NotQuery) and isinstance(query.negated, PredicateQuery) \
+            and query.negated.predicate.name != "=":
+        return [], [query.negated.predicate], True
+    if isinstance(query, AndQuery):
+        positive = []
+        negative = []
+        exact = True
+        for q in query.queries:
+            sub_positive, sub_negative, sub_exact = precondition_literals(q)
+            positive += sub_positive
+            negative += sub_negative
+            exact = exact and sub_exact
+        return positive, negative, exact
+    atoms, exact = precondition_atoms(query)
+    return atoms, [], exact
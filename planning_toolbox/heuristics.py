@@ -0,0 +1,557 @@
+from .pddl import *
+from .grounding import precondition_literals
+
+from collections import deque
+from functools import reduce
+from heapq import heappush, heappop
+from operator import and_
+
+
+INF = float("inf")
+
+
+class RelaxedTask:
+    """ Delete relaxation of the ground operators of a problem, stored as flat
+    tables indexed by the fact ids of the problem's InternTable. Every outcome
+    of an operator (see Action.outcomes) becomes a relaxed operator with the
+    positive atoms of the operator's precondition, and every conditional
+    effect a further relaxed operator that also requires the positive atoms of
+    its condition (universal effects and goals are instantiated over the
+    objects of their types). Negative preconditions, deletes and negative
+    goals are ignored. Operators cost their increase of total-cost if the problem
+    minimizes a metric, and 1 otherwise.
+
+    States are evaluated one at a time with a generalized Dijkstra search
+    (h_max, h_add, and h_FF from the relaxed plan of the h_add supporters), or
+    in batches (boolean matrices as in batch.BatchTask) with a vectorized
+    Bellman-Ford fixpoint (see evaluate_batch) """
+
+    def __init__(self, problem, operators=None):
+        self.problem = problem
+        self.operators = list(problem.ground_operators() if operators is None
+                else operators)
+        table = problem.intern_table
+        for atom in problem.init.predicates:
+            table.fact_id(atom)
+        s0 = problem.get_initial_state()
+        metric = problem.goal.metric
+        use_costs = bool(metric) and metric[0] == "minimize"
+        # relaxed operators: preconditions, adds, costs and the index of the
+        # ground operator they come from
+        self.pre = []
+        self.add = []
+        self.cost = []
+        self.origin = []
+        for idx, op in enumerate(self.operators):
+            pre = precondition_literals(op.precondition)[0]
+            cost = op.get_cost(s0) if use_costs else 1
+            for _, effect in op.outcomes():
+                for condition, adds in relaxed_effects(problem, effect, []):
+                    if not adds: continue
+                    self.pre.append(tuple(sorted(set(map(table.fact_id, pre+condition)))))
+                    self.add.append(tuple(sorted(set(map(table.fact_id, adds)))))
+                    self.cost.append(cost)
+                    self.origin.append(idx)
+        goal = problem.goal.query
+        goal = relaxed_goal(problem, goal) if goal is not None else []
+        self.goal = tuple(sorted(set(map(table.fact_id, goal))))
+        self.nfacts = len(table.facts)
+        self.precondition_of = [[] for _ in range(self.nfacts)]
+        self.achievers = [[] for _ in range(self.nfacts)]
+        for o, (pre, add) in enumerate(zip(self.pre, self.add)):
+            for f in pre:
+                self.precondition_of[f].append(o)
+            for f in add:
+                self.achievers[f].append(o)
+        self.npre = [len(pre) for pre in self.pre]
+        self.no_pre = [o for o, n in enumerate(self.npre) if n == 0]
+        self._arrays = None
+
+    def state_facts(self, state):
+        """ Fact ids of the atoms of a (symbolic or packed) state """
+        if isinstance(state, PackedState):
+            bits = state.bits
+            while bits:
+                low = bits & -bits
+                yield low.bit_length()-1
+                bits ^= low
+        else:
+            fact_ids = self.problem.intern_table.fact_ids
+            for atom in state.predicates:
+                fid = fact_ids.get(atom)
+                if fid is not None: yield fid
+
+    def explore(self, state, additive=True):
+        """ Cost of reaching every fact from the state in the delete relaxation,
+        combining the costs of preconditions by sum (h_add) or by max
+        (h_max), and the relaxed operator that achieves each fact with that
+        cost (-1 for the facts of the state and the unreached ones). The
+        exploration stops as soon as the goal facts are reached """
+        cost = [INF]*self.nfacts
+        supporter = [-1]*self.nfacts
+        heap = []
+        for f in self.state_facts(state):
+            if f < self.nfacts:
+                cost[f] = 0
+                heap.append((0, f))
+        unsatisfied = self.npre.copy()
+        value = [0]*len(self.pre)
+        add, op_cost, precondition_of = self.add, self.cost, self.precondition_of
+        for o in self.no_pre:
+            v = op_cost[o]
+            for g in add[o]:
+                if v < cost[g]:
+                    cost[g] = v
+                    supporter[g] = o
+                    heap.append((v, g))
+        goals = set(self.goal)
+        remaining = len(goals)
+        heap.sort()
+        while heap and remaining:
+            c, f = heappop(heap)
+            if c > cost[f]: continue
+            if f in goals: remaining -= 1
+            for o in precondition_of[f]:
+                # facts are popped by increasing cost, so the last
+                # precondition reached has the highest one
+                value[o] = value[o] + c if additive else c
+                unsatisfied[o] -= 1
+                if not unsatisfied[o]:
+                    v = value[o] + op_cost[o]
+                    for g in add[o]:
+                        if v < cost[g]:
+                            cost[g] = v
+                            supporter[g] = o
+                            heappush(heap, (v, g))
+        return cost, supporter
+
+    def h_max(self, state):
+        cost, _ = self.explore(state, False)
+        return max((cost[g] for g in self.goal), default=0)
+
+    def h_add(self, state):
+        cost, _ = self.explore(state)
+        return sum(cost[g] for g in self.goal)
+
+    def h_ff(self, state):
+        plan = self.relaxed_plan(state)
+        return INF if plan is None else sum(self.cost[o] for o in plan)
+
+    def relaxed_plan(self, state, cost=None, supporter=None):
+        """ Set of relaxed operators that achieve the goal from the state,
+        following the h_add supporters, or None if the goal is unreachable.
+        helpful_actions maps them back to ground operators """
+        if supporter is None:
+            cost, supporter = self.explore(state)
+        if any(cost[g] == INF for g in self.goal):
+            return None
+        plan = set()
+        stack = list(self.goal)
+        seen = set(stack)
+        while stack:
+            o = supporter[stack.pop()]
+            if o < 0 or o in plan: continue
+            plan.add(o)
+            for p in self.pre[o]:
+                if p not in seen:
+                    seen.add(p)
+                    stack.append(p)
+        return plan
+
+    def helpful_actions(self, state):
+        """ Ground operators applicable in the state that appear in its relaxed
+        plan, to rank or prune the candidate actions of a state """
+        plan = self.relaxed_plan(state)
+        if not plan: return []
+        origins = set(self.operators[self.origin[o]].tuple_representation()
+                for o in plan)
+        return [op for op in self.problem.applicable_actions(state)
+                if op.tuple_representation() in origins]
+
+    def arrays(self):
+        """ numpy arrays used by evaluate_batch: the k-th precondition of every
+        relaxed operator (a K x O matrix, padded with the index nfacts of a
+        fact of cost 0), the facts that have achievers sorted by their number
+        of achievers, and the j-th achiever of each of those facts (one array
+        per j, covering the facts with more than j achievers) """
+        import numpy as np
+        if self._arrays is None:
+            pre = np.full((max(self.npre, default=0), len(self.pre)),
+                    self.nfacts, dtype=np.int64)
+            for o, facts in enumerate(self.pre):
+                pre[:len(facts),o] = facts
+            achieved = sorted((f for f in range(self.nfacts) if self.achievers[f]),
+                    key=lambda f: -len(self.achievers[f]))
+            ranks = []
+            for j in range(len(self.achievers[achieved[0]]) if achieved else 0):
+                ranks.append(np.array([self.achievers[f][j] for f in achieved
+                    if len(self.achievers[f]) > j], dtype=np.int64))
+            # single precision halves the memory traffic of the gathers, and
+            # is exact for the integer costs of most problems
+            exact = all(float(c).is_integer() and abs(c) < 2**24 for c in self.cost)
+            dtype = np.float32 if exact else np.float64
+            self._arrays = (pre, np.array(achieved, dtype=np.int64), ranks,
+                    np.array(self.cost, dtype=dtype)[:,None],
+                    np.array(self.goal, dtype=np.int64))
+        return self._arrays
+
+    def evaluate_batch(self, states, kind="ff"):
+        """ Vector with the h_max, h_add or h_FF value (kind is "max", "add" or
+        "ff") of every row of an N x F boolean matrix over fact ids (see
+        batch.BatchTask). The costs of all the rows are relaxed at once until
+        they reach a fixpoint; the relaxed plans of h_FF are then extracted
+        row by row (breaking ties between achievers of equal cost by their
+        order, which may give a different relaxed plan than h_ff) """
+        import numpy as np
+        assert kind in ("max", "add", "ff")
+        pre, achieved, ranks, op_cost, goal = self.arrays()
+        n = len(states)
+        # costs are stored fact-major ((F+1) x N, the last row being the
+        # padding fact), so every gather copies whole rows into preallocated
+        # buffers
+        cost = np.full((self.nfacts+1, n), INF, dtype=op_cost.dtype)
+        cost[-1] = 0
+        width = min(states.shape[1], self.nfacts)
+        cost[:width][states[:,:width].T] = 0
+        combine = np.maximum if kind == "max" else np.add
+        value = np.empty((len(self.pre), n), dtype=op_cost.dtype)
+        buffer = np.empty_like(value)
+        reached = np.empty((len(achieved), n), dtype=op_cost.dtype)
+        candidate = np.empty_like(reached)
+        while True:
+            if len(pre):
+                np.take(cost, pre[0], axis=0, out=value)
+                for k in range(1, len(pre)):
+                    np.take(cost, pre[k], axis=0, out=buffer)
+                    combine(value, buffer, out=value)
+            else:
+                value.fill(0)
+            value += op_cost
+            if not len(achieved): break
+            np.take(value, ranks[0], axis=0, out=reached)
+            for rank in ranks[1:]:
+                m = len(rank)
+                np.take(value, rank, axis=0, out=candidate[:m])
+                np.minimum(reached[:m], candidate[:m], out=reached[:m])
+            current = cost[achieved]
+            np.minimum(current, reached, out=reached)
+            if np.array_equal(reached, current): break
+            cost[achieved] = reached
+        cost = cost[:-1].T.astype(float)
+        if kind == "max":
+            return cost[:,goal].max(axis=1, initial=0)
+        if kind == "add":
+            return cost[:,goal].sum(axis=1)
+        value = value.T.astype(float)
+        result = np.empty(n)
+        for row in range(n):
+            row_cost, row_value = cost[row], value[row]
+            if np.any(row_cost[goal] == INF):
+                result[row] = INF
+                continue
+            # supporters are only needed for the facts of the relaxed plan
+            supporter = _LazySupporters(self.achievers, states[row], row_value)
+            plan = self.relaxed_plan(None, row_cost, supporter)
+            result[row] = sum(self.cost[o] for o in plan)
+        return result
+
+
+class _LazySupporters:
+    """ Cheapest achiever of each fact that is not true in the state (-1 for
+    the true ones), computed on demand from the values of the relaxed
+    operators """
+
+    def __init__(self, achievers, state, value):
+        self.achievers = achievers
+        self.state = state
+        self.value = value
+
+    def __getitem__(self, f):
+        if f < len(self.state) and self.state[f]: return -1
+        return min(self.achievers[f], key=self.value.__getitem__, default=-1)
+
+
+class LandmarkGraph:
+    """ Fact landmarks of a problem (atoms that every plan makes true at some
+    point) and their orderings, extracted from the delete relaxation (see
+    RelaxedTask) with Zhu and Givan's label propagation. The label of a fact
+    is the set of facts that every relaxed plan from the initial state makes
+    true before it, including the fact itself, and the landmarks are the union
+    of the labels of the goals.
+
+    A landmark l is naturally ordered before l' when l is in the label of l',
+    and greedy-necessarily ordered before l' (as in Richter, Helmert and
+    Westphal's landmarks) when it is a precondition of all the first
+    achievers of l', the relaxed operators that add l' and can be applied
+    before l' is reached. Landmarks are numbered 0..n-1, and sets of them are
+    stored as bitmasks over these numbers """
+
+    def __init__(self, relaxed):
+        self.relaxed = relaxed
+        problem = relaxed.problem
+        label, op_label = self.labels()
+        self.solvable = all(label[g] is not None for g in relaxed.goal)
+        mask = 0
+        if self.solvable:
+            for g in relaxed.goal:
+                mask |= label[g]
+        # fact ids, atoms and numbers of the landmarks
+        self.facts = [f for f in range(relaxed.nfacts) if mask >> f & 1]
+        self.atoms = [problem.intern_table.facts[f] for f in self.facts]
+        self.number = {f: k for k, f in enumerate(self.facts)}
+        self.all = (1 << len(self.facts)) - 1
+        self.goal = self.to_landmarks(sum(1 << g for g in set(relaxed.goal)))
+        s0 = relaxed.state_facts(problem.get_initial_state())
+        self.initial = self.to_landmarks(sum(1 << f for f in set(s0)))
+        # natural and greedy-necessary orderings: landmarks ordered before and
+        # after every landmark
+        self.parents = []
+        self.first_achievers = []
+        self.necessary = []
+        for k, f in enumerate(self.facts):
+            self.parents.append(self.to_landmarks(label[f]) & ~(1 << k))
+            first = [] if self.initial >> k & 1 else [o for o in relaxed.achievers[f]
+                    if op_label[o] is not None and not op_label[o] >> f & 1]
+            self.first_achievers.append(first)
+            shared = self.to_landmarks(reduce(and_, [sum(1 << p
+                for p in relaxed.pre[o]) for o in first])) if first else 0
+            self.necessary.append(shared & ~(1 << k))
+        self.necessary_children = [0]*len(self.facts)
+        for k, parents in enumerate(self.necessary):
+            for j in bits(parents):
+                self.necessary_children[j] |= 1 << k
+        # landmarks sorted so that the parents of every landmark come first
+        self.order = sorted(range(len(self.facts)),
+                key=lambda k: bin(self.parents[k]).count("1"))
+
+    def labels(self):
+        """ Labels (bitmasks over fact ids) of the facts and of the relaxed
+        operators, None for the unreachable ones. The label of an operator
+        is the union of the labels of its preconditions. Labels are
+        propagated until they reach a fixpoint, intersecting the labels that
+        arrive at a fact through different achievers """
+        relaxed = self.relaxed
+        label = [None]*relaxed.nfacts
+        op_label = [None]*len(relaxed.pre)
+        unsatisfied = relaxed.npre.copy()
+        queue = deque(relaxed.no_pre)
+        queued = [False]*len(relaxed.pre)
+        for o in relaxed.no_pre:
+            queued[o] = True
+        def reach(f):
+            for o in relaxed.precondition_of[f]:
+                unsatisfied[o] -= 1
+                if not unsatisfied[o] and not queued[o]:
+                    queued[o] = True
+                    queue.append(o)
+        for f in set(relaxed.state_facts(relaxed.problem.get_initial_state())):
+            if f < relaxed.nfacts:
+                label[f] = 1 << f
+                reach(f)
+        while queue:
+            o = queue.popleft()
+            queued[o] = False
+            current = 0
+            for p in relaxed.pre[o]:
+                current |= label[p]
+            op_label[o] = current
+            for f in relaxed.add[o]:
+                old = label[f]
+                new = current | 1 << f
+                if old is not None:
+                    new &= old
+                    if new == old: continue
+                label[f] = new
+                if old is None:
+                    reach(f)
+                else:
+                    for o2 in relaxed.precondition_of[f]:
+                        if not unsatisfied[o2] and not queued[o2]:
+                            queued[o2] = True
+                            queue.append(o2)
+        return label, op_label
+
+    def to_landmarks(self, mask):
+        """ Bitmask over landmark numbers of the landmarks in a bitmask over
+        fact ids """
+        result = 0
+        for k, f in enumerate(self.facts):
+            if mask >> f & 1:
+                result |= 1 << k
+        return result
+
+    def orderings(self):
+        """ List of (atom, atom, kind) with the orderings between landmarks,
+        kind being "greedy-necessary" or "natural" """
+        result = []
+        for k in range(len(self.facts)):
+            for j in bits(self.parents[k]):
+                kind = "greedy-necessary" if self.necessary[k] >> j & 1 else "natural"
+                result.append((self.atoms[j], self.atoms[k], kind))
+        return result
+
+    def true_in(self, state, mask=None):
+        """ Bitmask of the landmarks (among the ones in mask, by default all)
+        that hold in the state """
+        result = 0
+        atoms = self.atoms
+        for k in bits(self.all if mask is None else mask):
+            if state.has_predicate(atoms[k]):
+                result |= 1 << k
+        return result
+
+    def __len__(self):
+        return len(self.facts)
+
+
+class LandmarkCount:
+    """ Landmark-count heuristic (as in LAMA) over the landmarks of a problem
+    (see LandmarkGraph): the number of landmarks that have not been accepted
+    on the path to the state, plus the number of accepted ones that are false
+    in the state and must be achieved again, because they are goals or are
+    greedy-necessarily ordered before a landmark that is not accepted yet.
+
+    The heuristic is path dependent. A landmark is accepted when an action
+    makes it true after all its parents have been accepted; the search calls
+    reached(parent, action, state) for every state it generates, which
+    updates the accepted landmarks of the state from the ones of its parent
+    (only the landmarks the action may add are checked). A state reached
+    through several paths keeps the landmarks accepted in all of them. The
+    accepted landmarks of a state that has not been reached (such as the
+    initial state) are the ones that hold in it and whose parents hold too """
+
+    def __init__(self, problem):
+        self.graph = problem.landmark_graph()
+        self.accepted = {}
+        # landmarks that every ground operator may add, by id of the operator
+        relaxed = self.graph.relaxed
+        number = self.graph.number
+        self.added = {}
+        for origin, add in zip(relaxed.origin, relaxed.add):
+            key = id(relaxed.operators[origin])
+            mask = self.added.get(key, 0)
+            for f in add:
+                if f in number:
+                    mask |= 1 << number[f]
+            self.added[key] = mask
+
+    def accepted_in(self, state):
+        """ Bitmask of the landmarks accepted in the state """
+        accepted = self.accepted.get(state)
+        if accepted is None:
+            graph = self.graph
+            true = graph.true_in(state)
+            accepted = 0
+            for k in graph.order:
+                if true >> k & 1 and not graph.parents[k] & ~accepted:
+                    accepted |= 1 << k
+            self.accepted[state] = accepted
+        return accepted
+
+    def reached(self, parent, action, state):
+        graph = self.graph
+        accepted = self.accepted_in(parent)
+        candidates = self.added.get(id(action), graph.all) & ~accepted
+        new = accepted
+        for k in bits(candidates):
+            if not graph.parents[k] & ~accepted and state.has_predicate(graph.atoms[k]):
+                new |= 1 << k
+        old = self.accepted.get(state)
+        self.accepted[state] = new if old is None else old & new
+
+    def __call__(self, state):
+        graph = self.graph
+        if not graph.solvable: return INF
+        accepted = self.accepted_in(state)
+        h = bin(graph.all & ~accepted).count("1")
+        false = accepted & ~graph.true_in(state, accepted)
+        for k in bits(false):
+            if graph.goal >> k & 1 or graph.necessary_children[k] & ~accepted:
+                h += 1
+        return h
+
+
+def bits(mask):
+    """ Positions of the bits set in a non-negative int """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length()-1
+        mask ^= low
+
+
+def relaxed_effects(problem, effect, condition):
+    """ List of (condition atoms, added atoms) pairs with the positive atoms
+    of the conditions under which a ground effect adds atoms. Universal
+    effects are instantiated over the objects, and the outcomes of nested
+    probabilistic effects are all taken """
+    if isinstance(effect, AddEffect):
+        return [(condition, [effect.add])]
+    if isinstance(effect, AndEffect):
+        unconditional = []
+        result = []
+        for e in effect.effects:
+            for c, adds in relaxed_effects(problem, e, condition):
+                if c is condition: unconditional += adds
+                else: result.append((c, adds))
+        return [(condition, unconditional)] + result if unconditional else result
+    if isinstance(effect, ConditionalEffect):
+        return relaxed_effects(problem, effect.rhs,
+                condition + precondition_literals(effect.lhs)[0])
+    if isinstance(effect, ForallEffect):
+        table = problem.intern_table
+        result = []
+        for sigma in all_possible_assignments(problem, effect.parameters):
+            result += relaxed_effects(problem, effect.effect.bind(sigma, table), condition)
+        return result
+    if isinstance(effect, ProbabilisticEffect):
+        # nested outcomes (e.g. in a universal effect) may all happen
+        result = []
+        for _, e in effect.effects:
+            result += relaxed_effects(problem, e, condition)
+        return result
+    return []
+
+
+def relaxed_goal(problem, query):
+    """ Positive atoms of the top level conjunction of a ground goal, with
+    universal goals instantiated over the objects """
+    if isinstance(query, ForallQuery):
+        table = problem.intern_table
+        result = []
+        for sigma in all_possible_assignments(problem, query.parameters):
+            result += relaxed_goal(problem, query.query.bind(sigma, table))
+        return result
+    if isinstance(query, AndQuery):
+        return [a for q in query.queries for a in relaxed_goal(problem, q)]
+    return precondition_literals(query)[0]
+
+
+def goal_count(problem):
+    """ Heuristic that counts the literals of the goal's top level
+    conjunction that the state does not satisfy """
+    positive, negative, _ = precondition_literals(problem.goal.query)
+    def h(state):
+        return sum(not state.has_predicate(a) for a in positive) + \
+                sum(state.has_predicate(a) for a in negative)
+    return h
+
+
+def h_max(problem):
+    """ Admissible h_max heuristic of the problem (see RelaxedTask) """
+    return problem.relaxed_task().h_max
+
+
+def h_add(problem):
+    """ h_add heuristic of the problem (see RelaxedTask) """
+    return problem.relaxed_task().h_add
+
+
+def h_ff(problem):
+    """ FF heuristic (cost of a relaxed plan) of the problem (see
+    RelaxedTask) """
+    return problem.relaxed_task().h_ff
+
+
+def landmark_count(problem):
+    """ Landmark-count heuristic of the problem (see LandmarkCount) """
+    return LandmarkCount(problem)
@@ -0,0 +1,258 @@
+import time
+import random
+
+from .heuristics import h_max
+
+
+class SSP:
+    """ Stochastic shortest path view of a (probabilistic) problem over its
+    ground operators, shared by the MDP solvers. The transitions of a state
+    (its applicable operators, their costs and the distribution of their
+    successors, see Action.successors) are generated once, when the state is
+    first expanded, and the value of a state is initialized with the
+    heuristic. Actions cost their increase of total-cost if the problem
+    minimizes a metric, and 1 otherwise. States are packed (see PackedState),
+    so looking them up in the tables compares integers.
+
+    Dead ends are handled with a finite penalty: the value of every state is
+    capped at dead_end, the cost of giving up, so states without applicable
+    actions or with an infinite heuristic value cost dead_end, and the solvers
+    converge in problems where the goal cannot be reached with certainty """
+
+    def __init__(self, problem, heuristic=None, dead_end=500):
+        self.problem = problem
+        self.h = (h_max if heuristic is None else heuristic)(problem)
+        self.dead_end = dead_end
+        metric = problem.goal.metric
+        self.use_costs = bool(metric) and metric[0] == "minimize"
+        self.value = {}
+        self._transitions = {}
+
+    def is_goal(self, state):
+        return self.problem.goal.is_satisfied(state)
+
+    def get_value(self, state):
+        value = self.value.get(state)
+        if value is None:
+            value = 0 if self.is_goal(state) else min(self.h(state), self.dead_end)
+            self.value[state] = value
+        return value
+
+    def is_expanded(self, state):
+        return state in self._transitions
+
+    def transitions(self, state):
+        """ List of (operator, cost, [(probability, successor), ...]) with the
+        operators applicable in the state. Outcomes that lead to the same
+        successor are merged """
+        transitions = self._transitions.get(state)
+        if transitions is None:
+            transitions = []
+            if not self.is_goal(state):
+                for op in self.problem.applicable_actions(state):
+                    cost = op.get_cost(state) if self.use_costs else 1
+                    successors = {}
+                    for p, succ in op.successors(state):
+                        successors[succ] = successors.get(succ, 0) + p
+                    transitions.append((op, cost, [(p, s) for s, p in successors.items()]))
+            self._transitions[state] = transitions
+        return transitions
+
+    def greedy(self, state):
+        """ Best Q-value of the state and the (index of the) transition that
+        achieves it, or None if the state is a goal or giving up is best """
+        if self.is_goal(state): return 0, None
+        best, best_idx = self.dead_end, None
+        get_value = self.get_value
+        for idx, (_, cost, successors) in enumerate(self.transitions(state)):
+            q = cost + sum(p*get_value(s) for p, s in successors)
+            if q < best:
+                best, best_idx = q, idx
+        return best, best_idx
+
+    def backup(self, state):
+        """ Bellman backup of the state. Returns its residual and the index of
+        its greedy transition """
+        q, idx = self.greedy(state)
+        residual = abs(q - self.get_value(state))
+        self.value[state] = q
+        return residual, idx
+
+    def best_action(self, state):
+        """ Greedy operator of the state, or None """
+        _, idx = self.greedy(state)
+        return None if idx is None else self.transitions(state)[idx][0]
+
+    def policy(self, state):
+        """ Dictionary from the states reachable from the given one by the
+        greedy policy (among the expanded ones) to the (name, *args) tuples
+        of their greedy operators """
+        policy = {}
+        stack = [state]
+        seen = {state}
+        while stack:
+            s = stack.pop()
+            if not self.is_expanded(s): continue
+            _, idx = self.greedy(s)
+            if idx is None: continue
+            op, _, successors = self.transitions(s)[idx]
+            policy[s] = op.tuple_representation()
+            for _, succ in successors:
+                if succ not in seen:
+                    seen.add(succ)
+                    stack.append(succ)
+        return policy
+
+
+class MDPSolver:
+    """ Base class of the in-process MDP solvers. They are called with a
+    problem and a timeout, like the planners of the solvers module, and
+    optionally a packed state to start from (by default, the initial state).
+    They return a dictionary with the greedy policy from that state
+    ("policy", see SSP.policy; its keys are packed states), its expected cost
+    ("value"), whether it converged ("solved"), and statistics. The SSP (with
+    the values and transitions computed) is returned too ("ssp"), so it can
+    be passed back to resume the search from other states, without
+    modifying the problem or grounding it again """
+
+    def __init__(self, heuristic=None, epsilon=1e-3, dead_end=500):
+        self.heuristic = heuristic
+        self.epsilon = epsilon
+        self.dead_end = dead_end
+
+    def solve(self, ssp, state, deadline):
+        raise NotImplementedError()
+
+    def __call__(self, problem, timeout=None, ssp=None, state=None):
+        start = time.time()
+        if ssp is None:
+            ssp = SSP(problem, self.heuristic, self.dead_end)
+        if state is None:
+            state = problem.get_initial_state().pack()
+        deadline = None if timeout is None else start + timeout
+        result = self.solve(ssp, state, deadline)
+        result["policy"] = ssp.policy(state)
+        result["value"] = ssp.get_value(state)
+        result["ssp"] = ssp
+        result["expanded"] = len(ssp._transitions)
+        result["time-wall"] = result["total-elapsed"] = time.time() - start
+        return result
+
+
+class LRTDP(MDPSolver):
+    """ Labeled RTDP (Bonet and Geffner, 2003). Trials follow the greedy
+    policy from the initial state, sampling the outcomes of its actions
+    with a seeded rng, and then label as solved the states whose greedy
+    graph has converged (all residuals below epsilon), until the initial
+    state is solved """
+
+    def __init__(self, heuristic=None, epsilon=1e-3, dead_end=500, seed=None,
+            max_trial_length=1000):
+        super().__init__(heuristic, epsilon, dead_end)
+        self.rng = random.Random(seed)
+        self.max_trial_length = max_trial_length
+
+    def solve(self, ssp, state, deadline):
+        solved = set()
+        trials = 0
+        timeout = False
+        while state not in solved:
+            if deadline is not None and time.time() > deadline:
+                timeout = True
+                break
+            self.trial(ssp, state, solved)
+            trials += 1
+        return {"solved": state in solved, "timeout": timeout, "trials": trials}
+
+    def trial(self, ssp, state, solved):
+        visited = []
+        while state not in solved and len(visited) < self.max_trial_length:
+            visited.append(state)
+            _, idx = ssp.backup(state)
+            if idx is None: break
+            state = self.sample(ssp.transitions(state)[idx][2])
+        while visited:
+            if not self.check_solved(ssp, visited.pop(), solved): break
+
+    def sample(self, successors):
+        u = self.rng.random()
+        for p, succ in successors:
+            u -= p
+            if u < 0: return succ
+        return successors[-1][1]
+
+    def check_solved(self, ssp, state, solved):
+        converged = True
+        open_ = [] if state in solved else [state]
+        closed = []
+        seen = set(open_)
+        while open_:
+            s = open_.pop()
+            closed.append(s)
+            q, idx = ssp.greedy(s)
+            if abs(q - ssp.get_value(s)) > self.epsilon:
+                converged = False
+                continue
+            if idx is None: continue
+            for _, succ in ssp.transitions(s)[idx][2]:
+                if succ not in solved and succ not in seen:
+                    seen.add(succ)
+                    open_.append(succ)
+        if converged:
+            solved.update(closed)
+        else:
+            while closed:
+                ssp.backup(closed.pop())
+        return converged
+
+
+class ILAOStar(MDPSolver):
+    """ Improved LAO* (Hansen and Zilberstein, 2001). Every iteration makes a
+    depth-first traversal of the greedy graph of the initial state,
+    expanding its unexpanded states and backing up the expanded ones in
+    postorder. It stops when an iteration expands no state and the largest
+    residual is below epsilon """
+
+    def solve(self, ssp, state, deadline):
+        iterations = 0
+        timeout = False
+        while True:
+            if deadline is not None and time.time() > deadline:
+                timeout = True
+                break
+            iterations += 1
+            expansions, residual = self.iteration(ssp, state)
+            if not expansions and residual < self.epsilon:
+                break
+        return {"solved": not timeout, "timeout": timeout, "iterations": iterations}
+
+    def iteration(self, ssp, state):
+        expansions = 0
+        residual = 0
+        seen = {state}
+        # (state, successors still to visit) pairs; states are backed up
+        # once all their successors have been visited
+        stack = [(state, None)]
+        while stack:
+            s, pending = stack[-1]
+            if pending is None:
+                if not ssp.is_expanded(s):
+                    ssp.transitions(s)
+                    expansions += 1
+                    stack.pop()
+                    residual = max(residual, ssp.backup(s)[0])
+                    continue
+                _, idx = ssp.greedy(s)
+                pending = [] if idx is None else \
+                        [succ for _, succ in ssp.transitions(s)[idx][2]]
+                stack[-1] = (s, pending)
+            while pending and pending[-1] in seen:
+                pending.pop()
+            if pending:
+                succ = pending.pop()
+                seen.add(succ)
+                stack.append((succ, None))
+            else:
+                stack.pop()
+                residual = max(residual, ssp.backup(s)[0])
+        return expansions, residual
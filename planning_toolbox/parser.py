@@ -2,12 +2,23 @@
 
 import re
 import io
+import os
+import pickle
+import hashlib
+import tempfile
+import multiprocessing
 
 from . import pddl
 
 
 COMMENTS_RE = re.compile(";.*$", re.MULTILINE)
 FRACTION_RE = re.compile("[0-9]+/[0-9]+")
+TOKEN_RE = re.compile(r"[()]|[^\s()]+")
+NUMBER_START = frozenset("0123456789+-.")
+
+# Bump whenever the output of the parser (or the layout of the pddl classes)
+# changes, so stale entries of a ParseCache are not loaded
+PARSER_VERSION = 7
 
 
 class SyntaxTree:
@@ -67,28 +78,63 @@ def tokenize(text):
     return text.replace("(", " ( ").replace(")", " ) ").split()
 
 
+def tokenize_stream(stream):
+    """ Generator over the tokens of a stream of text. The stream can be a file
+    object, a string, a bytes-like object (e.g. memoryview) or any iterable of
+    lines. Comments are removed and the text is lowercased line by line, so
+    the whole text is never held in memory """
+    if isinstance(stream, str):
+        stream = io.StringIO(stream)
+    elif isinstance(stream, (bytes, bytearray, memoryview)):
+        stream = io.BytesIO(stream)
+    for line in stream:
+        if isinstance(line, (bytes, bytearray)):
+            line = line.decode()
+        comment = line.find(";")
+        if comment >= 0:
+            line = line[:comment]
+        yield from TOKEN_RE.findall(line.lower())
+
+
 def atom(token):
-    try: return SyntaxTree(int(token))
-    except ValueError: pass
-    if FRACTION_RE.match(token): return SyntaxTree(eval(token))
-    try: return SyntaxTree(float(token))
-    except ValueError: pass
+    if token[0] in NUMBER_START:
+        try: return SyntaxTree(int(token))
+        except ValueError: pass
+        if FRACTION_RE.match(token): return SyntaxTree(eval(token))
+        try: return SyntaxTree(float(token))
+        except ValueError: pass
     return SyntaxTree(token)
 
 
+def read_tree(tokens):
+    """ Reads the next S-expression from an iterator of tokens, consuming only
+    the tokens that belong to it. Nested lists are built with an explicit stack
+    instead of recursion, so the depth of the tree is not bounded by Python's
+    recursion limit """
+    stack = []
+    for token in tokens:
+        if token == "(":
+            stack.append([])
+            continue
+        if token == ")":
+            if not stack:
+                raise SyntaxError("unexpected )")
+            tree = SyntaxTree(stack.pop())
+        else:
+            tree = atom(token)
+        if not stack:
+            return tree
+        stack[-1].append(tree)
+    raise SyntaxError("unexpected EOF")
+
+
 def read_from_tokens(tokens):
-    if not tokens:
-        raise SyntaxError("unexpected EOF")
-    token = tokens.pop()
-    if token == "(":
-        L = []
-        while tokens[-1] != ")":
-            L.append(read_from_tokens(tokens))
-        tokens.pop() # pop off ")"
-        return SyntaxTree(L)
-    elif token == ")":
-        raise SyntaxError("unexpected )")
-    return atom(token)
+    """ Reads an S-expression from a reversed list of tokens (i.e. the next
+    token is the last one), popping the consumed tokens """
+    def pop_tokens():
+        while tokens:
+            yield tokens.pop()
+    return read_tree(pop_tokens())
 
 
 def process_types(tree):
@@ -152,14 +198,12 @@ def process_query(tree, domain):
     def is_predicate_symbol(tree):
         if tree[0].node == "=" and domain.allows_equality_predicate():
             ret = tree[1].is_symbol() and tree[2].is_symbol()
-            ret = ret and tree[1].node not in (f.name for f in domain.functions)
-            ret = ret and tree[2].node not in (f.name for f in domain.functions)
+            ret = ret and not domain.is_function(tree[1].node)
+            ret = ret and not domain.is_function(tree[2].node)
             return ret
-        return tree[0].node in (p.name for p in domain.predicates)
+        return domain.is_predicate(tree[0].node)
     def is_function_symbol(tree):
-        if tree[0].node == "reward" and domain.allows_reward_fluent():
-            return True
-        return tree[0].node in (f.name for f in domain.functions)
+        return domain.is_function(tree[0].node)
     query = None
     if not tree:
         query = pddl.EmptyQuery()
@@ -204,7 +248,7 @@ def process_effect(tree, domain):
     effect = None
     if not tree:
         effect = pddl.EmptyEffect()
-    elif tree[0].node in (p.name for p in domain.predicates):
+    elif domain.is_predicate(tree[0].node):
         effect = pddl.AddEffect(process_functional(tree))
     elif tree[0].node == "not":
         effect = pddl.DeleteEffect(process_functional(tree[1]))
@@ -294,25 +338,160 @@ def process_problem(tree, domain):
     return problem
 
 
-def parse(text, type_="domain", domain=None):
+def parse_stream(stream, type_="domain", domain=None):
     assert type_ in ("raw", "domain", "problem", "both")
-    text_wo_comments = remove_comments(text.lower())
-    tokens = tokenize(text_wo_comments)
-    tokens.reverse()
+    tokens = tokenize_stream(stream)
     if type_ == "raw":
-        return read_from_tokens(tokens)
+        return read_tree(tokens)
     elif type_ == "domain":
-        return process_domain(read_from_tokens(tokens))
+        return process_domain(read_tree(tokens))
     elif type_ == "problem":
-        return process_problem(read_from_tokens(tokens), domain)
+        return process_problem(read_tree(tokens), domain)
     else: # type_ == both
-        domain = process_domain(read_from_tokens(tokens))
-        problem = process_problem(read_from_tokens(tokens), domain)
+        domain = process_domain(read_tree(tokens))
+        problem = process_problem(read_tree(tokens), domain)
         return domain, problem
 
 
-def parse_file(filename, type_="domain", domain=None):
-    with open(filename,"r") as f:
-        text = f.read()
-    return parse(text, type_, domain)
+def parse(text, type_="domain", domain=None):
+    return parse_stream(text, type_, domain)
+
+
+def parse_file(filename, type_="domain", domain=None, cache=None):
+    """ Parses a file. If cache is given (a ParseCache or a path to a cache
+    directory), the parsed object is looked up by the hash of the file
+    contents and only parsed (and stored) when missing """
+    if cache is None:
+        with open(filename,"r") as f:
+            return parse_stream(f, type_, domain)
+    if not isinstance(cache, ParseCache):
+        cache = ParseCache(cache)
+    with open(filename,"rb") as f:
+        data = f.read()
+    key = cache.key(data, type_, domain)
+    obj = cache.load(key, domain)
+    if obj is None:
+        obj = parse_stream(data, type_, domain)
+        cache.store(key, obj)
+    return obj
+
+
+_worker_domain = None
+
+
+def _init_parse_worker(domain):
+    global _worker_domain
+    _worker_domain = domain
+
+
+def _parse_problem_in_worker(args):
+    filename, cache = args
+    problem = parse_file(filename, "problem", _worker_domain, cache)
+    # the domain is re-attached in the parent process, no need to send it back
+    problem.domain = None
+    return problem
+
 
+def parse_many(filenames, domain, processes=None, cache=None):
+    """ Parses several problem files of the same domain across a pool of
+    processes, returning the problems in the same order as filenames. The
+    domain is sent once to every worker (not once per file) and the returned
+    problems are attached to the given domain object. processes defaults to
+    the number of CPUs; with processes=1 the files are parsed sequentially """
+    filenames = list(filenames)
+    if processes is None:
+        processes = min(len(filenames), os.cpu_count() or 1)
+    if processes <= 1:
+        return [parse_file(f, "problem", domain, cache) for f in filenames]
+    if cache is not None and not isinstance(cache, ParseCache):
+        cache = ParseCache(cache)
+    with multiprocessing.Pool(processes, _init_parse_worker, (domain,)) as pool:
+        problems = pool.map(_parse_problem_in_worker,
+                [(f, cache) for f in filenames])
+    for problem in problems:
+        problem.domain = domain
+    return problems
+
+
+class ParseCache:
+    """ Content-addressed on-disk cache of parsed objects (syntax trees,
+    domains, problems or domain-problem pairs). Entries are keyed by a hash of
+    the file contents, the parser version, the type of object and (for
+    problems) the domain they are parsed against. The cache is bounded by
+    max_size bytes: the least recently used entries are evicted first """
+
+    SUFFIX = ".pkl"
+
+    def __init__(self, directory, max_size=256*2**20):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, data, type_, domain=None):
+        h = hashlib.sha256()
+        h.update("{}:{}:".format(PARSER_VERSION, type_).encode())
+        if type_ == "problem":
+            h.update(hashlib.sha256(str(domain).encode()).digest())
+        h.update(data)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ParseCache.SUFFIX)
+
+    def load(self, key, domain=None):
+        """ Returns the cached object (None on a miss). Cached problems are
+        stored without their domain, which is re-attached here """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                obj = pickle.load(f)
+            os.utime(path) # mark as recently used
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # corrupt or incompatible entry: treat as a miss
+            self._remove(path)
+            return None
+        if isinstance(obj, pddl.Problem):
+            obj.domain = domain
+        return obj
+
+    def store(self, key, obj):
+        detached = isinstance(obj, pddl.Problem)
+        if detached:
+            domain, obj.domain = obj.domain, None
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            self._remove(tmp)
+            raise
+        finally:
+            if detached: obj.domain = domain
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(ParseCache.SUFFIX):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size: break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(ParseCache.SUFFIX):
+                self._remove(entry.path)
+
+    @staticmethod
+    def _remove(path):
+        try: os.remove(path)
+        except FileNotFoundError: pass
@@ -0,0 +1,486 @@
+from .pddl import *
+from .grounding import precondition_literals
+from .batch import outcome_literals
+
+import os
+import json
+
+import numpy as np
+
+
+INF = float("inf")
+
+
+class FDRTask:
+    """ Finite-domain view of the ground operators of a problem, used to build
+    pattern databases. Variables are groups of fluent atoms (the ones that
+    some operator adds or deletes) of which at most one holds in every
+    reachable state (see mutex_groups), plus a binary variable for every
+    remaining fluent. Value i < len(group) of a variable means that the i-th
+    atom of its group holds, and value len(group) that none does.
+
+    Every outcome of an operator (see Action.outcomes) becomes an operator
+    with a precondition and an effect (dictionaries from variables to
+    values), and the variables that it resets to "none" if they have a given
+    value (deletes of atoms that the precondition does not require). Static
+    atoms are dropped, and so are the negative preconditions and goals on
+    atoms of non-binary variables. Operators cost their increase of
+    total-cost if the problem minimizes a metric, and 1 otherwise.
+
+    Universal effects are instantiated over the objects (see
+    batch.outcome_literals), but conditional effects and probabilistic effects
+    nested in universal ones are not compiled into the abstraction: building
+    the task raises NotImplementedError on the first operator that has them """
+
+    def __init__(self, problem, operators=None):
+        self.problem = problem
+        operators = list(problem.ground_operators() if operators is None
+                else operators)
+        s0 = problem.get_initial_state()
+        metric = problem.goal.metric
+        use_costs = bool(metric) and metric[0] == "minimize"
+        strips = []
+        for idx, op in enumerate(operators):
+            pos, neg, _ = precondition_literals(op.precondition)
+            cost = op.get_cost(s0) if use_costs else 1
+            for _, adds, deletes, steps in outcome_literals(problem, op):
+                if steps is not None:
+                    raise NotImplementedError("Pattern databases do not support "
+                            "conditional or nested probabilistic effects, as in " +
+                            op.short_str())
+                strips.append((frozenset(pos), neg, adds, deletes, cost, idx))
+        fluents = {}
+        for _, _, adds, deletes, _, _ in strips:
+            for atom in adds + deletes:
+                fluents.setdefault(atom, None)
+        init = set(atom for atom in problem.init.predicates if atom in fluents)
+        fluents = list(fluents)
+        self.variables = [tuple(group) for group in
+                mutex_groups(fluents, strips, init)]
+        self.value_of = {}
+        for var, group in enumerate(self.variables):
+            for val, atom in enumerate(group):
+                self.value_of[atom] = (var, val)
+        # operators: (precondition, effect, conditional resets, cost, index of
+        # the ground operator)
+        self.operators = []
+        for pos, neg, adds, deletes, cost, idx in strips:
+            op = self.operator(pos, neg, adds, deletes)
+            if op is not None:
+                self.operators.append(op + (cost, idx))
+        goal = problem.goal.query
+        pos, neg, _ = precondition_literals(goal) if goal is not None \
+                else ([], [], True)
+        self.goal = self.condition(pos, neg)
+
+    def none(self, var):
+        """ Value of a variable when none of its atoms holds """
+        return len(self.variables[var])
+
+    def values(self, atoms):
+        """ List with the value of every variable given the atoms that hold """
+        values = [len(group) for group in self.variables]
+        for atom in atoms:
+            entry = self.value_of.get(atom)
+            if entry is not None:
+                values[entry[0]] = entry[1]
+        return values
+
+    def condition(self, positive, negative):
+        """ Dictionary from variables to values equivalent to the literals
+        (ignoring static atoms and negative literals on non-binary
+        variables), or None if the literals are contradictory """
+        result = {}
+        for atom in positive:
+            entry = self.value_of.get(atom)
+            if entry is None: continue
+            var, val = entry
+            if result.get(var, val) != val: return None
+            result[var] = val
+        for atom in negative:
+            entry = self.value_of.get(atom)
+            if entry is None or len(self.variables[entry[0]]) > 1: continue
+            var = entry[0]
+            if result.get(var, 1) != 1: return None
+            result[var] = 1
+        return result
+
+    def operator(self, positive, negative, adds, deletes):
+        pre = self.condition(positive, negative)
+        if pre is None: return None
+        effect = {}
+        for atom in adds:
+            var, val = self.value_of[atom]
+            effect[var] = val
+        resets = []
+        for atom in deletes:
+            var, val = self.value_of[atom]
+            if var in effect: continue
+            if pre.get(var, val) != val: continue
+            if var in pre or len(self.variables[var]) == 1:
+                effect[var] = self.none(var)
+            else:
+                resets.append((var, val))
+        return pre, effect, tuple(resets)
+
+
+class PatternDatabase:
+    """ Goal distances of all the abstract states of the projection of an
+    FDRTask onto a pattern (a tuple of variables). Abstract states are
+    numbered in mixed radix by the values of the variables of the pattern,
+    the first one varying fastest. Integer distances are stored in the
+    smallest unsigned type that fits them, its maximum value marking the
+    states from which the goal is unreachable """
+
+    def __init__(self, pattern, domains, table):
+        self.pattern = tuple(pattern)
+        self.domains = tuple(domains)
+        self.radix = tuple(int(r) for r in np.cumprod((1,) + self.domains[:-1]))
+        self.table = table
+        self.unreachable = np.iinfo(table.dtype).max \
+                if np.issubdtype(table.dtype, np.integer) else np.inf
+
+    def index(self, values):
+        """ Number of the abstract state of the given variable values """
+        return sum(values[v]*r for v, r in zip(self.pattern, self.radix))
+
+    def distance(self, values):
+        d = self.table[self.index(values)]
+        return INF if d == self.unreachable else float(d)
+
+    def distances(self, values):
+        """ Vector with the distances of the rows of an N x V matrix of
+        variable values """
+        index = values[:,self.pattern] @ np.array(self.radix, dtype=np.int64)
+        d = self.table[index].astype(float)
+        d[self.table[index] == self.unreachable] = INF
+        return d
+
+    def __len__(self):
+        return len(self.table)
+
+
+class PDBHeuristic:
+    """ Heuristic that combines pattern databases over the same variables
+    (given as tuples of atoms). The value of a state is the maximum, over a
+    list of cliques of databases, of the sum of the distances of the
+    databases in the clique. The canonical heuristic uses the maximal cliques
+    of databases whose patterns are additive (no operator affects two of
+    them); with zero-one cost partitioning (see build_pdbs) all the databases
+    form a single clique.
+
+    The heuristic depends on the atoms of states only, so it can be saved,
+    loaded (memory-mapping the tables) and reused by the searches of other
+    problems with the same operators and goal, e.g. when replanning from
+    the states that an agent reaches """
+
+    def __init__(self, variables, databases, cliques):
+        self.variables = [tuple(group) for group in variables]
+        self.value_of = {}
+        for var, group in enumerate(self.variables):
+            for val, atom in enumerate(group):
+                if atom is not None:
+                    self.value_of[atom] = (var, val)
+        self.databases = databases
+        self.cliques = cliques
+
+    def values(self, state):
+        values = [len(group) for group in self.variables]
+        value_of = self.value_of
+        for atom in state.predicates:
+            entry = value_of.get(atom)
+            if entry is not None:
+                values[entry[0]] = entry[1]
+        return values
+
+    def __call__(self, state):
+        values = self.values(state)
+        distances = [db.distance(values) for db in self.databases]
+        return max((sum(distances[i] for i in clique) for clique in self.cliques),
+                default=0)
+
+    def evaluate_batch(self, states, table):
+        """ Vector with the values of the rows of an N x F boolean matrix
+        whose columns are the fact ids of an InternTable (see
+        batch.BatchTask) """
+        values = np.empty((len(states), len(self.variables)), dtype=np.int64)
+        for var, group in enumerate(self.variables):
+            columns = [table.fact_ids.get(atom, -1) for atom in group]
+            holds = np.zeros((len(states), len(group)+1), dtype=bool)
+            holds[:,-1] = True
+            for val, fid in enumerate(columns):
+                if 0 <= fid < states.shape[1]:
+                    holds[:,val] = states[:,fid]
+            values[:,var] = np.argmax(holds, axis=1)
+        distances = [db.distances(values) for db in self.databases]
+        result = np.zeros(len(states))
+        for k, clique in enumerate(self.cliques):
+            total = sum((distances[i] for i in clique), np.zeros(len(states)))
+            result = total if k == 0 else np.maximum(result, total)
+        return result
+
+    def save(self, directory):
+        """ Saves the tables as .npy files, and the variables, patterns and
+        cliques as pdbs.json, in the given directory """
+        os.makedirs(directory, exist_ok=True)
+        databases = []
+        for idx, db in enumerate(self.databases):
+            name = "pdb-{}.npy".format(idx)
+            np.save(os.path.join(directory, name), db.table)
+            databases.append({"pattern": db.pattern, "domains": db.domains,
+                "table": name})
+        variables = [[None if atom is None else
+            [atom.name, *(o.name for o in atom.arguments)] for atom in group]
+            for group in self.variables]
+        with open(os.path.join(directory, "pdbs.json"), "w") as f:
+            json.dump({"variables": variables, "databases": databases,
+                "cliques": self.cliques}, f)
+
+
+def mutex_groups(atoms, operators, init, budget=200):
+    """ List of groups of atoms of which at most one holds in every state
+    reachable from init, covering every atom once. operators are tuples
+    (positive precondition, negative precondition, adds, deletes, ...). A
+    group is balanced, and thus invariant, if at most one of its atoms holds
+    in init and every operator that adds an atom of the group requires and
+    deletes another one (and adds no other atom of it). Every atom is grown
+    into a balanced group by adding the atoms that the unbalanced operators
+    require and delete, trying at most budget extensions; the atoms that are
+    not part of any balanced group form singleton groups """
+    adders = {atom: [] for atom in atoms}
+    for op in operators:
+        for atom in op[2]:
+            adders[atom].append(op)
+
+    def candidates(group):
+        # None if the group is balanced, and the atoms that would balance the
+        # first unbalanced operator otherwise (empty if it cannot be balanced)
+        if sum(atom in init for atom in group) > 1: return []
+        for atom in group:
+            for pos, _, adds, deletes, *_ in adders[atom]:
+                if sum(a in group for a in adds) > 1: return []
+                if atom in pos or any(d in group and d in pos for d in deletes):
+                    continue
+                return [d for d in deletes if d in pos and d not in group]
+        return None
+
+    def grow(group, remaining):
+        extensions = candidates(group)
+        if extensions is None: return group
+        for atom in extensions:
+            if remaining[0] <= 0: break
+            remaining[0] -= 1
+            found = grow(group | {atom}, remaining)
+            if found is not None: return found
+        return None
+
+    found = []
+    covered = set()
+    for atom in atoms:
+        if atom in covered: continue
+        group = grow(frozenset([atom]), [budget])
+        if group is not None and len(group) > 1:
+            found.append(group)
+            covered |= group
+    # larger groups first, every atom in the first group that contains it
+    order = {atom: idx for idx, atom in enumerate(atoms)}
+    groups = []
+    assigned = set()
+    for group in sorted(found, key=len, reverse=True):
+        group = sorted(group - assigned, key=order.get)
+        if group:
+            groups.append(group)
+            assigned.update(group)
+    groups += [[atom] for atom in atoms if atom not in assigned]
+    return groups
+
+
+def project(task, pattern, costs=None):
+    """ PatternDatabase of the projection of an FDRTask onto a pattern. The
+    distances are computed backwards from the abstract goal states, relaxing
+    all the abstract transitions at once until a fixpoint is reached: every
+    iteration extends the search by one layer, so with unit costs this is a
+    breadth-first search. costs optionally replaces the costs of the
+    operators (see build_pdbs) """
+    pattern = tuple(pattern)
+    domains = [task.none(v)+1 for v in pattern]
+    position = {v: j for j, v in enumerate(pattern)}
+    radix = np.cumprod([1] + domains[:-1]).astype(np.int64)
+    size = int(np.prod(domains))
+    index = np.arange(size, dtype=np.int64)
+    values = [(index // r) % d for r, d in zip(radix, domains)]
+    # abstract operators, with the minimum cost of the operators that are
+    # projected onto them
+    abstract = {}
+    for o, (pre, effect, resets, cost, _) in enumerate(task.operators):
+        key = (tuple((position[v], x) for v, x in effect.items() if v in position),
+                tuple((position[v], x) for v, x in resets if v in position))
+        if not key[0] and not key[1]: continue
+        key = (tuple((position[v], x) for v, x in pre.items() if v in position),) + key
+        cost = cost if costs is None else costs[o]
+        abstract[key] = min(abstract.get(key, INF), cost)
+    sources, targets, weights = [], [], []
+    for (pre, effect, resets), cost in abstract.items():
+        applicable = np.ones(size, dtype=bool)
+        for j, x in pre:
+            applicable &= values[j] == x
+        src = np.flatnonzero(applicable)
+        dst = src.copy()
+        for j, x in effect:
+            dst += (x - values[j][src]) * radix[j]
+        for j, x in resets:
+            dst += np.where(values[j][src] == x, (domains[j]-1-x)*radix[j], 0)
+        moved = dst != src
+        sources.append(src[moved])
+        targets.append(dst[moved])
+        weights.append(np.full(np.count_nonzero(moved), cost, dtype=float))
+    goal = np.ones(size, dtype=bool)
+    for v, x in task.goal.items():
+        if v in position:
+            goal &= values[position[v]] == x
+    distance = np.full(size, INF)
+    distance[goal] = 0
+    if sources:
+        src = np.concatenate(sources)
+        order = np.argsort(src, kind="stable")
+        src = src[order]
+        dst = np.concatenate(targets)[order]
+        weight = np.concatenate(weights)[order]
+        states, starts = np.unique(src, return_index=True)
+        while len(states):
+            best = np.minimum(distance[states],
+                    np.minimum.reduceat(weight + distance[dst], starts))
+            if np.array_equal(best, distance[states]): break
+            distance[states] = best
+    finite = distance[distance < INF]
+    if all(float(c).is_integer() for c in abstract.values()) and \
+            (not len(finite) or finite.max() < np.iinfo(np.uint32).max):
+        top = finite.max() if len(finite) else 0
+        dtype = next(t for t in (np.uint8, np.uint16, np.uint32)
+                if top < np.iinfo(t).max)
+        table = np.where(distance < INF, distance, np.iinfo(dtype).max).astype(dtype)
+    else:
+        table = distance.astype(np.float32)
+    return PatternDatabase(pattern, domains, table)
+
+
+def select_patterns(task, max_states=50000):
+    """ One pattern for every goal variable, grown with the variables that
+    the goal variable depends on in the causal graph (closest first) while
+    the number of abstract states stays within max_states. Patterns that
+    are contained in others are dropped """
+    # causal graph: the variables that appear in the precondition or effect
+    # of the operators that affect every variable
+    parents = [set() for _ in task.variables]
+    for pre, effect, resets, _, _ in task.operators:
+        affected = set(effect) | set(v for v, _ in resets)
+        for v in affected:
+            parents[v].update(pre)
+            parents[v].update(affected)
+    patterns = []
+    for goal_var in task.goal:
+        pattern = [goal_var]
+        size = task.none(goal_var)+1
+        frontier = [goal_var]
+        seen = {goal_var}
+        while frontier:
+            following = []
+            for v in frontier:
+                for u in sorted(parents[v] - seen):
+                    seen.add(u)
+                    if size * (task.none(u)+1) <= max_states:
+                        size *= task.none(u)+1
+                        pattern.append(u)
+                        following.append(u)
+            frontier = following
+        patterns.append(tuple(sorted(pattern)))
+    sets = [set(p) for p in patterns]
+    result = []
+    for idx, pattern in enumerate(patterns):
+        if any(sets[idx] < sets[j] or (sets[idx] == sets[j] and j < idx)
+                for j in range(len(patterns))):
+            continue
+        result.append(pattern)
+    return result
+
+
+def additive_cliques(task, patterns):
+    """ Maximal sets of patterns that no operator affects more than one of """
+    affected_by = []
+    for pattern in patterns:
+        pattern = set(pattern)
+        affected_by.append(set(o for o, (_, effect, resets, _, _) in
+            enumerate(task.operators) if pattern.intersection(effect) or
+            pattern.intersection(v for v, _ in resets)))
+    n = len(patterns)
+    neighbours = [set(j for j in range(n) if j != i and
+        not affected_by[i] & affected_by[j]) for i in range(n)]
+    cliques = []
+    def expand(clique, candidates, excluded):
+        # Bron-Kerbosch with pivoting
+        if not candidates and not excluded:
+            cliques.append(sorted(clique))
+            return
+        pivot = max(candidates | excluded, key=lambda v: len(neighbours[v] & candidates))
+        for v in list(candidates - neighbours[pivot]):
+            expand(clique | {v}, candidates & neighbours[v], excluded & neighbours[v])
+            candidates = candidates - {v}
+            excluded = excluded | {v}
+    if n: expand(set(), set(range(n)), set())
+    return cliques
+
+
+def build_pdbs(problem, patterns=None, combine="canonical", max_states=50000):
+    """ PDBHeuristic of a problem over the given patterns (tuples of variables
+    of its FDRTask; see select_patterns by default). With combine set to
+    "canonical", every database uses the full costs, and the heuristic is
+    the canonical heuristic of the additive cliques. With "additive", each
+    operator costs as much as in the first database that it affects, and 0
+    in the others (zero-one cost partitioning), so the sum of all the
+    databases is admissible """
+    assert combine in ("canonical", "additive")
+    task = FDRTask(problem)
+    if patterns is None:
+        patterns = select_patterns(task, max_states)
+    if combine == "canonical":
+        databases = [project(task, pattern) for pattern in patterns]
+        cliques = additive_cliques(task, patterns)
+    else:
+        paid = set()
+        databases = []
+        for pattern in patterns:
+            pattern = set(pattern)
+            costs = []
+            for o, (_, effect, resets, cost, _) in enumerate(task.operators):
+                if o not in paid and (pattern.intersection(effect) or
+                        pattern.intersection(v for v, _ in resets)):
+                    paid.add(o)
+                    costs.append(cost)
+                else:
+                    costs.append(0)
+            databases.append(project(task, pattern, costs))
+        cliques = [list(range(len(databases)))]
+    return PDBHeuristic(task.variables, databases, cliques)
+
+
+def load_pdbs(directory, problem, mmap=True):
+    """ PDBHeuristic saved in a directory (see PDBHeuristic.save), with its
+    atoms mapped to the ones of the given problem (interned if the problem has
+    not seen them yet, so it does not need to be grounded first). The tables
+    are memory-mapped unless mmap is False """
+    with open(os.path.join(directory, "pdbs.json")) as f:
+        data = json.load(f)
+    atom = problem.intern_table.atom
+    variables = [[None if key is None else atom(Predicate(*key)) for key in group]
+            for group in data["variables"]]
+    databases = [PatternDatabase(db["pattern"], db["domains"],
+        np.load(os.path.join(directory, db["table"]), mmap_mode="r" if mmap else None))
+        for db in data["databases"]]
+    return PDBHeuristic(variables, databases, data["cliques"])
+
+
+def pdb_heuristic(problem):
+    """ Canonical pattern database heuristic of the problem (see build_pdbs).
+    To reuse the databases across searches, build them once and pass
+    lambda problem: heuristic to the planner """
+    return build_pdbs(problem)
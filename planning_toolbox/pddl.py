@@ -3,13 +3,17 @@
 #################
 
 import warnings
-from copy   import deepcopy
+from collections import OrderedDict
+from copy   import copy
 from functools import reduce
 from itertools import product
+from operator import add, sub, mul, truediv, lt, gt, le, eq, ge, itemgetter, xor
 from random import random
 
 class Object:
 
+    __slots__ = ("name", "type")
+
     def __init__(self, name, type_=None):
         self.name = name
         self.type = type_
@@ -17,14 +21,17 @@ class Object:
     def is_ground(self):
         return self.name[0] != "?"
 
-    def bind(self, sigma):
+    def bind(self, sigma, table=None):
         try:
-            return Object(sigma[self.name], self.type)
+            name = sigma[self.name]
         except KeyError:
             return self
+        if table is not None:
+            return table.object(name, self.type)
+        return Object(name, self.type)
 
     def copy(self):
-        return deepcopy(self)
+        return copy(self)
 
     def strip_type(self):
         return Object(self.name)
@@ -33,7 +40,7 @@ class Object:
         return hash(self.name)
 
     def __eq__(self, other):
-        return other.name == self.name 
+        return self is other or other.name == self.name
 
     def __str__(self):
         if self.type is not None:
@@ -43,14 +50,17 @@ class Object:
 
 class ObjectList:
 
+    __slots__ = ("objects",)
+
     def __init__(self, *objects):
         self.objects = [to_object(obj) for obj in objects]
 
-    def bind(self, sigma):
-        return ObjectList(*(obj.bind(sigma) for obj in self.objects))
+    def bind(self, sigma, table=None):
+        return ObjectList(*(obj.bind(sigma, table) for obj in self.objects))
 
     def copy(self):
-        return deepcopy(self)
+        # objects are not modified once created, so they are shared
+        return ObjectList(*self.objects)
 
     def is_ground(self):
         return all(o.is_ground for o in self.objects)
@@ -71,7 +81,7 @@ class ObjectList:
         return bool(self.objects)
 
     def __eq__(self, other):
-        return self.objects == other.objects
+        return self is other or self.objects == other.objects
 
     def __hash__(self):
         return hash(tuple(self.objects))
@@ -94,18 +104,21 @@ class ObjectList:
 
 class Functional:
 
+    __slots__ = ("name", "arguments", "_hash")
+
     def __init__(self, name, *args):
         self.name = name
         if len(args) == 1 and isinstance(args[0], ObjectList):
             self.arguments = args[0]
         else:
             self.arguments = ObjectList(*args)
+        self._hash = None
 
     def arity(self):
         return len(self.arguments)
 
     def copy(self):
-        return deepcopy(self)
+        return copy(self)
 
     def is_ground(self):
         return self.arguments.is_ground()
@@ -113,17 +126,31 @@ class Functional:
     def strip_types(self):
         return Functional(self.name, self.arguments.strip_types())
 
-    def bind(self, sigma):
+    def bind(self, sigma, table=None):
+        if table is not None:
+            return table.bind(self, sigma)
         return Functional(self.name, self.arguments.bind(sigma))
 
     def signature(self):
         return "{}/{}".format(self.name, self.arity())
 
     def __eq__(self, other):
-        return other.name == self.name and other.arguments == self.arguments
+        if self is other: return True
+        return hash(self) == hash(other) and other.name == self.name and\
+                other.arguments == self.arguments
 
     def __hash__(self):
-        return hash((self.name,*self.arguments))
+        # the hash is cached: functionals are not modified once created
+        if self._hash is None:
+            self._hash = hash((self.name,*self.arguments))
+        return self._hash
+
+    def __getstate__(self):
+        # string hashes are salted per process, so the cached hash cannot be
+        # pickled along with the functional
+        state = slots_state(self)
+        state["_hash"] = None
+        return None, state
 
     def __repr__(self):
         return str(self)
@@ -135,11 +162,13 @@ class Functional:
 
 
 class Predicate(Functional):
-    pass
+    __slots__ = ()
 
 
 class Function(Functional):
-    
+
+    __slots__ = ("type",)
+
     def __init__(self, name, *args, type_=None):
         super().__init__(name, *args)
         self.type = type_
@@ -156,10 +185,20 @@ class Function(Functional):
 
 class Query:
 
+    __slots__ = ()
+
     def eval(self, state):
         raise NotImplementedError()
 
-    def bind(self, sigma):
+    def compile(self, parameters=()):
+        """ Compiles the query into a callable f(state, args) equivalent to
+        eval. args is a tuple with the names of the objects bound to the given
+        parameters (variable names), e.g. compile(["?x"])(state, ("a",)) is
+        equivalent to bind({"?x": "a"}).eval(state). The callable does not
+        traverse the query, so it should be reused across evaluations """
+        raise NotImplementedError()
+
+    def bind(self, sigma, table=None):
         raise NotImplementedError()
 
     def is_empty(self):
@@ -169,15 +208,23 @@ class Query:
         raise NotImplementedError()
 
     def copy(self):
-        return deepcopy(self)
+        """ Shallow copy. Queries are not modified once built (simplify and
+        the other transformations return new queries), so subqueries are
+        shared """
+        return copy(self)
 
 
 class EmptyQuery(Query):
-    
+
+    __slots__ = ()
+
     def eval(self, state):
         return True
 
-    def bind(self, sigma):
+    def compile(self, parameters=()):
+        return lambda state, args: True
+
+    def bind(self, sigma, table=None):
         return self
 
     def is_empty(self):
@@ -192,14 +239,24 @@ class EmptyQuery(Query):
 
 class PredicateQuery(Query):
 
+    __slots__ = ("predicate",)
+
     def __init__(self, predicate):
         self.predicate = predicate
 
     def eval(self, state):
         return state.has_predicate(self.predicate)
 
-    def bind(self, sigma):
-        return PredicateQuery(self.predicate.bind(sigma))
+    def compile(self, parameters=()):
+        if self.predicate.name == "=":
+            lhs, rhs = (compile_argument(o, parameters)
+                    for o in self.predicate.arguments)
+            return lambda state, args: lhs(args) == rhs(args)
+        atom = compile_atom(self.predicate, parameters)
+        return lambda state, args: state.has_predicate(atom(state, args))
+
+    def bind(self, sigma, table=None):
+        return PredicateQuery(self.predicate.bind(sigma, table))
 
     def is_empty(self):
         return False
@@ -213,14 +270,20 @@ class PredicateQuery(Query):
 
 class FunctionQuery(Query):
 
+    __slots__ = ("function",)
+
     def __init__(self, function):
         self.function = function
 
     def eval(self, state):
         return state.get_function_value(self.function)
 
-    def bind(self, sigma):
-        return FunctionQuery(self.function.bind(sigma))
+    def compile(self, parameters=()):
+        atom = compile_atom(self.function, parameters)
+        return lambda state, args: state.get_function_value(atom(state, args))
+
+    def bind(self, sigma, table=None):
+        return FunctionQuery(self.function.bind(sigma, table))
 
     def is_empty(self):
         return False
@@ -234,13 +297,19 @@ class FunctionQuery(Query):
 
 class Constant(Query):
 
+    __slots__ = ("constant",)
+
     def __init__(self, constant):
         self.constant = constant
 
     def eval(self, state):
         return self.constant
 
-    def bind(self, sigma):
+    def compile(self, parameters=()):
+        constant = self.constant
+        return lambda state, args: constant
+
+    def bind(self, sigma, table=None):
         return self
 
     def is_empty(self):
@@ -255,8 +324,12 @@ class Constant(Query):
 
 class ArithmeticQuery(Query):
 
+    __slots__ = ("operator", "lhs", "rhs")
+
     OPERATORS = ("+", "-", "*", "/")
 
+    FUNCTIONS = {"+": add, "-": sub, "*": mul, "/": truediv}
+
     def __init__(self, operator, lhs, rhs):
         assert operator in ArithmeticQuery.OPERATORS
         self.operator = operator
@@ -272,9 +345,13 @@ class ArithmeticQuery(Query):
         if operator == "*": return lhs*rhs
         return lhs/rhs
 
-    def bind(self, sigma):
-        return ArithmeticQuery(self.operator, self.lhs.bind(sigma),
-                self.rhs.bind(sigma))
+    def compile(self, parameters=()):
+        return compile_binary(ArithmeticQuery.FUNCTIONS[self.operator],
+                self.lhs, self.rhs, parameters)
+
+    def bind(self, sigma, table=None):
+        return ArithmeticQuery(self.operator, self.lhs.bind(sigma, table),
+                self.rhs.bind(sigma, table))
 
     def is_empty(self):
         return False
@@ -288,8 +365,12 @@ class ArithmeticQuery(Query):
 
 class ComparisonQuery(Query):
 
+    __slots__ = ("comparison", "lhs", "rhs")
+
     OPERATORS = ("<", ">", "<=", "=", ">=")
 
+    FUNCTIONS = {"<": lt, ">": gt, "<=": le, "=": eq, ">=": ge}
+
     def __init__(self, comparison, lhs, rhs):
         assert comparison in ComparisonQuery.OPERATORS
         self.comparison = comparison
@@ -299,16 +380,20 @@ class ComparisonQuery(Query):
     def eval(self, state):
         lhs = self.lhs.eval(state)
         rhs = self.rhs.eval(state)
-        comparison = self.head()
+        comparison = self.comparison
         if comparison == "<": return lhs < rhs
         if comparison == ">": return lhs > rhs
         if comparison == "<=": return lhs <= rhs
         if comparison == "=": return lhs == rhs
         return lhs >= rhs
 
-    def bind(self, sigma):
-        return ComparisonQuery(self.comparison, self.lhs.bind(sigma),
-                self.rhs.bind(sigma))
+    def compile(self, parameters=()):
+        return compile_binary(ComparisonQuery.FUNCTIONS[self.comparison],
+                self.lhs, self.rhs, parameters)
+
+    def bind(self, sigma, table=None):
+        return ComparisonQuery(self.comparison, self.lhs.bind(sigma, table),
+                self.rhs.bind(sigma, table))
 
     def is_empty(self):
         return False
@@ -322,14 +407,29 @@ class ComparisonQuery(Query):
 
 class AndQuery(Query):
 
+    __slots__ = ("queries",)
+
     def __init__(self, *queries):
         self.queries = list(queries)
 
     def eval(self, state):
         return all(a.eval(state) for a in self.queries)
 
-    def bind(self, sigma):
-        return AndQuery(*(a.bind(sigma) for a in self.queries))
+    def compile(self, parameters=()):
+        queries = tuple(q.compile(parameters) for q in self.queries)
+        if len(queries) == 1:
+            return queries[0]
+        if len(queries) == 2:
+            first, second = queries
+            return lambda state, args: first(state, args) and second(state, args)
+        def and_(state, args):
+            for query in queries:
+                if not query(state, args): return False
+            return True
+        return and_
+
+    def bind(self, sigma, table=None):
+        return AndQuery(*(a.bind(sigma, table) for a in self.queries))
 
     def is_empty(self):
         return all(q.is_empty() for q in self.queries)
@@ -337,20 +437,38 @@ class AndQuery(Query):
     def simplify(self):
         return simplify_and_or(self, "queries", EmptyQuery)
 
+    def copy(self):
+        return AndQuery(*self.queries)
+
     def __str__(self):
         return lisp_list_to_str("and", *self.queries)
 
 
 class OrQuery(Query):
 
+    __slots__ = ("queries",)
+
     def __init__(self, *queries):
         self.queries = list(queries)
 
     def eval(self, state):
         return any(a.eval(state) for a in self.queries)
 
-    def bind(self, sigma):
-        return OrQuery(*(a.bind(sigma) for a in self.queries))
+    def compile(self, parameters=()):
+        queries = tuple(q.compile(parameters) for q in self.queries)
+        if len(queries) == 1:
+            return queries[0]
+        if len(queries) == 2:
+            first, second = queries
+            return lambda state, args: first(state, args) or second(state, args)
+        def or_(state, args):
+            for query in queries:
+                if query(state, args): return True
+            return False
+        return or_
+
+    def bind(self, sigma, table=None):
+        return OrQuery(*(a.bind(sigma, table) for a in self.queries))
 
     def is_empty(self):
         return all(q.is_empty() for q in self.queries)
@@ -358,28 +476,38 @@ class OrQuery(Query):
     def simplify(self):
         return simplify_and_or(self, "queries", OrQuery)
 
+    def copy(self):
+        return OrQuery(*self.queries)
+
     def __str__(self):
         return lisp_list_to_str("or", *self.queries)
 
 
 class NotQuery(Query):
 
+    __slots__ = ("negated",)
+
     def __init__(self, negated):
         self.negated = negated
 
     def eval(self, state):
         return not self.negated.eval(state)
 
-    def bind(self, sigma):
-        return NotQuery(self.negated.bind(sigma))
+    def compile(self, parameters=()):
+        negated = self.negated.compile(parameters)
+        return lambda state, args: not negated(state, args)
+
+    def bind(self, sigma, table=None):
+        return NotQuery(self.negated.bind(sigma, table))
 
     def is_empty(self):
         return self.negated.is_empty()
 
     def simplify(self):
-        self.negated = self.negated.simplify()
-        if self.negated.is_empty(): return EmptyQuery()
-        return self
+        negated = self.negated.simplify()
+        if negated.is_empty(): return EmptyQuery()
+        if negated is self.negated: return self
+        return NotQuery(negated)
 
     def __str__(self):
         return lisp_list_to_str("not", self.negated)
@@ -387,6 +515,8 @@ class NotQuery(Query):
 
 class ImplyQuery(Query):
 
+    __slots__ = ("lhs", "rhs")
+
     def __init__(self, lhs, rhs):
         self.lhs = lhs
         self.rhs = rhs
@@ -394,18 +524,25 @@ class ImplyQuery(Query):
     def eval(self, state):
         return not self.lhs.eval(state) or self.rhs.eval(state)
 
-    def bind(self, sigma):
-        return ImplyQuery(self.lhs.bind(sigma), self.rhs.bind(sigma))
+    def compile(self, parameters=()):
+        lhs = self.lhs.compile(parameters)
+        rhs = self.rhs.compile(parameters)
+        return lambda state, args: not lhs(state, args) or rhs(state, args)
+
+    def bind(self, sigma, table=None):
+        return ImplyQuery(self.lhs.bind(sigma, table),
+                self.rhs.bind(sigma, table))
 
     def is_empty(self):
         return self.rhs.is_empty()
 
     def simplify(self):
-        self.lhs = self.lhs.simplify()
-        self.rhs = self.rhs.simplify()
-        if self.rhs.is_empty(): return EmptyQuery()
-        if self.lhs.is_empty(): return self.rhs
-        return self
+        lhs = self.lhs.simplify()
+        rhs = self.rhs.simplify()
+        if rhs.is_empty(): return EmptyQuery()
+        if lhs.is_empty(): return rhs
+        if lhs is self.lhs and rhs is self.rhs: return self
+        return ImplyQuery(lhs, rhs)
 
     def __str__(self):
         return lisp_list_to_str("imply", self.lhs, self.rhs)
@@ -413,25 +550,42 @@ class ImplyQuery(Query):
 
 class ForallQuery(Query):
 
+    __slots__ = ("parameters", "query")
+
     def __init__(self, parameters, query):
         self.parameters = parameters
         self.query = query
 
     def eval(self, state):
-        return all(self.query.bind(sigma).eval(state)
-                for sigma in all_possible_assignments(state.problem, self.parameters))
-
-
-    def bind(self, sigma):
-        return ForallQuery(self.parameters, self.query.bind(sigma))
+        # only the assignments that may falsify the query are checked
+        table = state.problem.intern_table
+        names = [p.name for p in self.parameters]
+        atoms = necessary_atoms(self.query, False)
+        return all(self.query.bind(dict(zip(names, values)), table).eval(state)
+                for values in join_assignments(state, self.parameters, atoms))
+
+    def compile(self, parameters=()):
+        # the quantified variables take the slots after the given parameters
+        quantified = self.parameters
+        query = self.query.compile((*parameters, *(p.name for p in quantified)))
+        atoms = necessary_atoms(self.query, False)
+        def forall(state, args):
+            sigma = dict(zip(parameters, args))
+            return all(query(state, args+values)
+                    for values in join_assignments(state, quantified, atoms, sigma))
+        return forall
+
+    def bind(self, sigma, table=None):
+        return ForallQuery(self.parameters, self.query.bind(sigma, table))
 
     def is_empty(self):
         return self.query.is_empty()
 
     def simplify(self):
-        self.query = self.query.simplify()
-        if self.query.is_empty(): return EmptyQuery()
-        return self
+        query = self.query.simplify()
+        if query.is_empty(): return EmptyQuery()
+        if query is self.query: return self
+        return ForallQuery(self.parameters, query)
 
     def __str__(self):
         return "(forall ({}) {})".format(self.parameters, self.query)
@@ -439,24 +593,42 @@ class ForallQuery(Query):
 
 class ExistsQuery(Query):
 
+    __slots__ = ("parameters", "query")
+
     def __init__(self, parameters, query):
         self.parameters = parameters
         self.query = query
 
     def eval(self, state):
-        return any(self.query.bind(sigma).eval(state)
-                for sigma in all_possible_assignments(state.problem, self.parameters))
-
-    def bind(self, sigma):
-        return ExistsQuery(self.parameters.bind(sigma), self.query.bind(sigma))
+        # only the assignments that may satisfy the query are checked
+        table = state.problem.intern_table
+        names = [p.name for p in self.parameters]
+        atoms = necessary_atoms(self.query)
+        return any(self.query.bind(dict(zip(names, values)), table).eval(state)
+                for values in join_assignments(state, self.parameters, atoms))
+
+    def compile(self, parameters=()):
+        quantified = self.parameters
+        query = self.query.compile((*parameters, *(p.name for p in quantified)))
+        atoms = necessary_atoms(self.query)
+        def exists(state, args):
+            sigma = dict(zip(parameters, args))
+            return any(query(state, args+values)
+                    for values in join_assignments(state, quantified, atoms, sigma))
+        return exists
+
+    def bind(self, sigma, table=None):
+        return ExistsQuery(self.parameters.bind(sigma, table),
+                self.query.bind(sigma, table))
 
     def is_empty(self):
         return self.query.is_empty()
 
     def simplify(self):
-        self.query = self.query.simplify()
-        if self.query.is_empty(): return EmptyQuery()
-        return self
+        query = self.query.simplify()
+        if query.is_empty(): return EmptyQuery()
+        if query is self.query: return self
+        return ExistsQuery(self.parameters, query)
 
     def __str__(self):
         return "(exists ({}) {})".format(self.parameters, self.query)
@@ -468,17 +640,24 @@ class ExistsQuery(Query):
 
 class Effect:
 
-    def apply(self, state, out=None):
+    __slots__ = ()
+
+    def apply(self, state, out=None, rng=None):
+        """ Successor of the state, written into out (by default, a copy of
+        the state). Probabilistic effects sample their outcomes with rng, any
+        object with a random() method (see AliasTable.sample) """
         raise NotImplementedError()
 
     def get_cost(self, state):
         raise NotImplementedError()
 
-    def bind(self, sigma):
+    def bind(self, sigma, table=None):
         raise NotImplementedError()
 
     def copy(self):
-        return deepcopy(self)
+        """ Shallow copy. Like queries, effects are not modified once built,
+        so subeffects are shared """
+        return copy(self)
 
     def count_additive_effects(self):
         raise NotImplementedError()
@@ -512,13 +691,15 @@ class Effect:
 
 class EmptyEffect(Effect):
 
-    def apply(self, state, out=None):
+    __slots__ = ()
+
+    def apply(self, state, out=None, rng=None):
         return out or state.copy()
 
     def get_cost(self, state):
         return 0
 
-    def bind(self, sigma):
+    def bind(self, sigma, table=None):
         return self
 
     def count_additive_effects(self):
@@ -551,16 +732,18 @@ class EmptyEffect(Effect):
 
 class AddEffect(Effect):
 
+    __slots__ = ("add",)
+
     def __init__(self, add):
         self.add = add
 
-    def apply(self, state, out=None):
+    def apply(self, state, out=None, rng=None):
         out = out or state.copy()
         out.add_predicate(self.add)
         return out
 
-    def bind(self, sigma):
-        return AddEffect(self.add.bind(sigma))
+    def bind(self, sigma, table=None):
+        return AddEffect(self.add.bind(sigma, table))
 
     def count_additive_effects(self):
         return 1
@@ -595,10 +778,12 @@ class AddEffect(Effect):
 
 class DeleteEffect(Effect):
 
+    __slots__ = ("delete",)
+
     def __init__(self, delete):
         self.delete = delete
 
-    def apply(self, state, out=None):
+    def apply(self, state, out=None, rng=None):
         out = out or state.copy()
         out.delete_predicate(self.delete)
         return out
@@ -606,8 +791,8 @@ class DeleteEffect(Effect):
     def get_cost(self, state):
         return 0
 
-    def bind(self, sigma):
-        return DeleteEffect(self.delete.bind(sigma))
+    def bind(self, sigma, table=None):
+        return DeleteEffect(self.delete.bind(sigma, table))
 
     def count_additive_effects(self):
         return 0
@@ -639,20 +824,22 @@ class DeleteEffect(Effect):
 
 class AndEffect(Effect):
 
+    __slots__ = ("effects",)
+
     def __init__(self, *effects):
         self.effects = list(effects)
 
-    def apply(self, state, out=None):
+    def apply(self, state, out=None, rng=None):
         out = out or state.copy()
         for effect in self.effects:
-            out = effect.apply(state, out)
+            out = effect.apply(state, out, rng)
         return out
 
     def get_cost(self, state):
         return sum(eff.get_cost(state) for eff in self.effects)
 
-    def bind(self, sigma):
-        return AndEffect(*(a.bind(sigma) for a in self.effects))
+    def bind(self, sigma, table=None):
+        return AndEffect(*(a.bind(sigma, table) for a in self.effects))
 
     def count_additive_effects(self):
         return sum(e.count_additive_effects() for e in self.effects)
@@ -682,37 +869,37 @@ class AndEffect(Effect):
         return mf
 
     def add_cost_offset(self, offset):
-        found = False
-        for e in self.effects:
+        for idx, e in enumerate(self.effects):
             if isinstance(e, AssignmentEffect) and e.lhs.name == "total-cost" \
                     and e.assignop == "increase" and isinstance(e.rhs, Constant):
-                e.rhs.constant += offset
-                found = True
-                break
-        if not found:
-            assigneff = AssignmentEffect("increase", Function("total-cost"),
-                    Constant(offset))
-            self.effects.append(assigneff)
-        return self
+                effects = self.effects.copy()
+                effects[idx] = e.add_cost_offset(offset)
+                return AndEffect(*effects)
+        assigneff = AssignmentEffect("increase", Function("total-cost"),
+                Constant(offset))
+        return AndEffect(*self.effects, assigneff)
 
     def transform_rewards_to_costs(self, alpha=1, inters=0, round_=0):
-        self.effects = [e.transform_rewards_to_costs(alpha,inters,round_)
-                for e in self.effects]
-        return self
+        return AndEffect(*(e.transform_rewards_to_costs(alpha,inters,round_)
+                for e in self.effects))
 
     def remove_reward_assignments(self):
-        self.effects = [e.remove_reward_assignments() for e in self.effects]
-        return self
+        return AndEffect(*(e.remove_reward_assignments() for e in self.effects))
 
     def simplify(self):
-        effects = []
-        for e in self.effects:
-            if isinstance(e, AndEffect):
-                effects += e.effects
-            else:
-                effects.append(e)
-        self.effects = effects
-        return simplify_and_or(self, "effects", EmptyEffect)
+        flat = self
+        if any(isinstance(e, AndEffect) for e in self.effects):
+            effects = []
+            for e in self.effects:
+                if isinstance(e, AndEffect):
+                    effects += e.effects
+                else:
+                    effects.append(e)
+            flat = AndEffect(*effects)
+        return simplify_and_or(flat, "effects", EmptyEffect)
+
+    def copy(self):
+        return AndEffect(*self.effects)
 
     def __len__(self):
         return len(self.effects)
@@ -723,24 +910,39 @@ class AndEffect(Effect):
 
 class ForallEffect(Effect):
 
+    __slots__ = ("parameters", "effect")
+
     def __init__(self, parameters, effect):
         self.parameters = parameters
         self.effect = effect
 
-    def apply(self, state, out=None):
+    def apply(self, state, out=None, rng=None):
        out = out or state.copy()
-       for sigma in all_possible_assignments(state.problem, self.parameters):
-           out = self.effect.bind(sigma).apply(state, out)
+       table = state.problem.intern_table
+       for sigma in self.assignments(state):
+           out = self.effect.bind(sigma, table).apply(state, out, rng)
        return out
 
     def get_cost(self, state):
         cost = 0
-        for sigma in all_possible_assignments(state.problem, self.parameters):
-            cost += self.effect.bind(sigma).get_cost(state)
+        for sigma in self.assignments(state):
+            cost += self.effect.bind(sigma, state.problem.intern_table).get_cost(state)
         return cost
 
-    def bind(self, sigma):
-        return ForallEffect(self.parameters.bind(sigma), self.effect.bind(sigma))
+    def assignments(self, state):
+        """ Assignments of the quantified variables for which the effect may
+        have any consequence. If the effect is conditional, only those that
+        may satisfy its condition are generated """
+        atoms = []
+        if isinstance(self.effect, ConditionalEffect):
+            atoms = necessary_atoms(self.effect.lhs)
+        names = [p.name for p in self.parameters]
+        for values in join_assignments(state, self.parameters, atoms):
+            yield dict(zip(names, values))
+
+    def bind(self, sigma, table=None):
+        return ForallEffect(self.parameters.bind(sigma, table),
+                self.effect.bind(sigma, table))
 
     def count_additive_effects(self):
         return self.effect.count_additive_effects()
@@ -762,17 +964,17 @@ class ForallEffect(Effect):
         return self.effect.modified_functions()
 
     def transform_rewards_to_costs(self, alpha=1, inters=0, round_=0):
-        self.effect = self.effect.transform_rewards_to_costs(alpha, inters, round_)
-        return self
+        return ForallEffect(self.parameters,
+                self.effect.transform_rewards_to_costs(alpha, inters, round_))
 
     def remove_reward_assignments(self):
-        self.effect = self.effect.remove_reward_assignments()
-        return self
+        return ForallEffect(self.parameters, self.effect.remove_reward_assignments())
 
     def simplify(self):
-        self.effect = self.effect.simplify()
-        if self.effect.is_empty(): return EmptyEffect()
-        return self
+        effect = self.effect.simplify()
+        if effect.is_empty(): return EmptyEffect()
+        if effect is self.effect: return self
+        return ForallEffect(self.parameters, effect)
 
     def __str__(self):
         return "(forall ({}) {})".format(self.parameters, self.effect)
@@ -780,15 +982,17 @@ class ForallEffect(Effect):
 
 class ConditionalEffect(Effect):
 
+    __slots__ = ("lhs", "rhs")
+
     def __init__(self, lhs, rhs):
         self.lhs = lhs
         self.rhs = rhs
 
-    def apply(self, state, out=None):
+    def apply(self, state, out=None, rng=None):
         out = out or state.copy()
         lhs = self.lhs.eval(state)
         if lhs:
-            out = self.rhs.apply(state, out)
+            out = self.rhs.apply(state, out, rng)
         return out
 
     def get_cost(self, state):
@@ -797,8 +1001,9 @@ class ConditionalEffect(Effect):
             return self.rhs.get_cost(state)
         return 0
 
-    def bind(self, sigma):
-        return ConditionalEffect(self.lhs.bind(sigma), self.rhs.bind(sigma))
+    def bind(self, sigma, table=None):
+        return ConditionalEffect(self.lhs.bind(sigma, table),
+                self.rhs.bind(sigma, table))
 
     def count_additive_effects(self):
         return self.rhs.count_additive_effects()
@@ -818,19 +1023,19 @@ class ConditionalEffect(Effect):
         return self.rhs.modified_functions()
 
     def transform_rewards_to_costs(self, alpha=1, inters=0, round_=0):
-        self.rhs = self.rhs.transform_rewards_to_costs(alpha, inters, round_)
-        return self
+        return ConditionalEffect(self.lhs,
+                self.rhs.transform_rewards_to_costs(alpha, inters, round_))
 
     def remove_reward_assignments(self):
-        self.rhs = self.rhs.remove_reward_assignments()
-        return self
+        return ConditionalEffect(self.lhs, self.rhs.remove_reward_assignments())
 
     def simplify(self):
-        self.lhs = self.lhs.simplify()
-        self.rhs = self.rhs.simplify()
-        if self.rhs.is_empty(): return EmptyEffect()
-        if self.lhs.is_empty(): return self.rhs
-        return self
+        lhs = self.lhs.simplify()
+        rhs = self.rhs.simplify()
+        if rhs.is_empty(): return EmptyEffect()
+        if lhs.is_empty(): return rhs
+        if lhs is self.lhs and rhs is self.rhs: return self
+        return ConditionalEffect(lhs, rhs)
 
     def __str__(self):
         return lisp_list_to_str("when", self.lhs, self.rhs)
@@ -838,6 +1043,8 @@ class ConditionalEffect(Effect):
 
 class AssignmentEffect(Effect):
 
+    __slots__ = ("assignop", "lhs", "rhs")
+
     OPERATORS = ("assign", "increase", "decrease", "scale-up", "scale-down")
 
     def __init__(self, assignop, lhs, rhs):
@@ -850,7 +1057,7 @@ class AssignmentEffect(Effect):
             traceback.print_stack()
             exit()
 
-    def apply(self, state, out=None):
+    def apply(self, state, out=None, rng=None):
         out = out or state.copy()
         lhs = state.get_function_value(self.lhs)
         rhs = self.rhs.eval(state)
@@ -875,9 +1082,9 @@ class AssignmentEffect(Effect):
                 return -self.rhs.eval(state)
         return 0
 
-    def bind(self, sigma):
-        return AssignmentEffect(self.assignop, self.lhs.bind(sigma),
-                self.rhs.bind(sigma))
+    def bind(self, sigma, table=None):
+        return AssignmentEffect(self.assignop, self.lhs.bind(sigma, table),
+                self.rhs.bind(sigma, table))
 
     def is_empty(self):
         return False
@@ -891,8 +1098,8 @@ class AssignmentEffect(Effect):
     def add_cost_offset(self, offset):
         if self.assignop == "increase" and self.lhs.name == "total-cost" and\
                 isinstance(self.rhs, Constant):
-            self.rhs.constant += offset
-            return self
+            return AssignmentEffect(self.assignop, self.lhs,
+                    Constant(self.rhs.constant + offset))
         return super().add_cost_offset(offset)
 
     def remove_reward_assignments(self):
@@ -902,12 +1109,14 @@ class AssignmentEffect(Effect):
     def transform_rewards_to_costs(self, alpha=1, inters=0, round_=0):
         if self.lhs.name == "reward":
             if self.assignop == "decrease":
-                self.lhs.name = "total-cost"
-                self.assignop = "increase"
-                if isinstance(self.rhs, Constant):
-                    self.rhs.constant = self.rhs.constant*alpha + inters
-                    if round_ > 0: self.rhs.constant = int(round(self.rhs.constant*10**round_))
-                    if self.rhs.constant < 1e-6: return EmptyEffect()
+                lhs = Function("total-cost", self.lhs.arguments)
+                rhs = self.rhs
+                if isinstance(rhs, Constant):
+                    constant = rhs.constant*alpha + inters
+                    if round_ > 0: constant = int(round(constant*10**round_))
+                    if constant < 1e-6: return EmptyEffect()
+                    rhs = Constant(constant)
+                return AssignmentEffect("increase", lhs, rhs)
             else: return EmptyEffect()
         return self
 
@@ -920,25 +1129,32 @@ class AssignmentEffect(Effect):
 
 class ProbabilisticEffect(Effect):
 
+    __slots__ = ("effects", "_alias")
+
     def __init__(self, *effects):
         total_prob = 0
         for p, _ in effects:
             total_prob += p
         assert total_prob < (1+1e-6)
         self.effects = list(effects)
+        self._alias = None
 
-    def apply(self, state, out=None):
+    def apply(self, state, out=None, rng=None):
         if out is None: out = state.copy()
-        r = random()
-        acc = 0
-        for p, e in self:
-            acc += p
-            # print("p: {}, e: {}, acc: {}, r: {}".format(p,e,acc,r))
-            if r < acc:
-                out = e.apply(state, out)
-                break
+        idx = self.sample_index(rng)
+        if idx is not None:
+            out = self.effects[idx][1].apply(state, out, rng)
         return out
 
+    def sample_index(self, rng=None):
+        """ Index of an outcome sampled in constant time (see AliasTable), or
+        None if no outcome occurs (when the probabilities add up to less than
+        1). The alias table is built on the first call """
+        if self._alias is None:
+            self._alias = AliasTable(p for p, _ in self.effects)
+        idx = self._alias.sample(rng)
+        return idx if idx < len(self.effects) else None
+
     def count_additive_effects(self):
         return max(e.count_additive_effects() for _,e in self.effects)
 
@@ -956,8 +1172,8 @@ class ProbabilisticEffect(Effect):
     def get_cost(self, state):
         return 0
         
-    def bind(self, sigma):
-        return ProbabilisticEffect(*((p,e.bind(sigma)) for p, e in self.effects))
+    def bind(self, sigma, table=None):
+        return ProbabilisticEffect(*((p,e.bind(sigma, table)) for p, e in self.effects))
 
     def is_empty(self):
         return all(e.is_empty() for _,e in self.effects)
@@ -971,28 +1187,30 @@ class ProbabilisticEffect(Effect):
     def modified_functions(self):
         mf = set()
         for p, e in self.effects:
-            mf.update(e.modified_predicates())
+            mf.update(e.modified_functions())
         return mf
 
     def transform_rewards_to_costs(self, alpha=1, inters=0, round_=0):
-        self.effects = [(p, e.transform_rewards_to_costs(alpha, inters, round_))
-                for p,e in self.effects]
-        return self
+        return ProbabilisticEffect(*((p, e.transform_rewards_to_costs(alpha, inters, round_))
+                for p,e in self.effects))
 
     def remove_reward_assignments(self):
-        self.effects = [(p,e.remove_reward_assignments()) for p,e in self.effects]
-        return self
+        return ProbabilisticEffect(*((p,e.remove_reward_assignments())
+                for p,e in self.effects))
 
     def simplify(self):
-        self.effects = [(p,e.simplify()) for p,e in self.effects]
-        # self.effects = [(p,e) for p,e in
+        effects = [(p,e.simplify()) for p,e in self.effects]
+        # effects = [(p,e) for p,e in
                 # map(lambda t: (t[0],t[1].simplify()), self.effects)
                 # if not e.is_empty() and p > 1e-6]
-        # if len(self.effects) == 1 and abs(self.effects[0][0] - 1) < 1e-6:
-            # return self.effects[0][1]
-        if not self.effects:
+        # if len(effects) == 1 and abs(effects[0][0] - 1) < 1e-6:
+            # return effects[0][1]
+        if not effects:
             return EmptyEffect()
-        return self
+        return ProbabilisticEffect(*effects)
+
+    def copy(self):
+        return ProbabilisticEffect(*self.effects)
 
     def sum_to_one(self):
         accprob = 0
@@ -1024,27 +1242,86 @@ class Action:
         self.parameters = ObjectList() if parameters is None else parameters
         self.precondition = EmptyQuery() if precondition is None else precondition
         self.effect = EmptyEffect() if effect is None else effect
+        self._caches = {}
 
     def is_applicable(self, state):
-        return self.precondition.eval(state)
-
-    def apply(self, state):
-        if self.precondition.eval(state):
-            new_state = self.effect.apply(state)
-            if state.problem.goal.reward and state.problem.goal.query.eval(new_state):
-                new_state.reward += state.problem.goal.reward
-            return new_state
+        return self.compiled_precondition()(state, ())
+
+    def compiled_precondition(self):
+        """ Compiled precondition (see Query.compile), rebuilt whenever the
+        precondition is replaced """
+        return cached(self, "precondition", self.precondition,
+                lambda: self.precondition.compile())
+
+    def apply(self, state, rng=None):
+        if self.is_applicable(state):
+            return self._successor(state, self.effect, rng)
         return None
 
+    def outcomes(self):
+        """ List of (probability, effect) pairs with the outcomes of the action
+        (see Effect.expand_probabilistic_effects). It is built once and rebuilt
+        only when the effect is replaced. Probabilistic effects nested in
+        universal effects are not expanded, since their outcomes depend on the
+        objects, so these outcomes are not deterministic: successors
+        enumerates them in each state, and apply and sample_successor sample
+        them with the given rng """
+        return cached(self, "outcomes", self.effect,
+                lambda: self.effect.expand_probabilistic_effects().effects)
+
+    def sample_outcome(self, rng=None):
+        """ (probability, effect) pair of an outcome sampled in constant time
+        (see AliasTable) with the given rng """
+        outcomes = self.outcomes()
+        table = cached(self, "outcome_sampler", self.effect,
+                lambda: AliasTable(p for p, _ in outcomes))
+        # expand_probabilistic_effects neglects a remaining mass below 1e-6
+        return outcomes[min(table.sample(rng), len(outcomes)-1)]
+
+    def successors(self, state):
+        """ List of (probability, state) pairs with the successors of the state
+        for every outcome of the action. The probabilistic effects nested in
+        an outcome are enumerated too (see outcome_distribution), merging the
+        equal successors that they lead to. The precondition is not checked """
+        outcomes = self.outcomes()
+        nested = cached(self, "nested_outcomes", self.effect,
+                lambda: [has_nested_probabilistic(e) for _, e in outcomes])
+        result = []
+        for (p, e), is_nested in zip(outcomes, nested):
+            if not is_nested:
+                result.append((p, self._successor(state, e)))
+                continue
+            for succ, q in outcome_distribution(state, e, {state.copy(): 1.0}).items():
+                result.append((p*q, self._goal_reward(succ)))
+        return result
+
+    def sample_successor(self, state, rng=None):
+        """ Successor of the state for an outcome sampled with the given rng
+        (see sample_outcome), which also samples the probabilistic effects
+        nested in the outcome. The precondition is not checked """
+        return self._successor(state, self.sample_outcome(rng)[1], rng)
+
+    def _successor(self, state, effect, rng=None):
+        return self._goal_reward(effect.apply(state, None, rng))
+
+    def _goal_reward(self, new_state):
+        goal = new_state.problem.goal
+        if goal.reward and goal.is_satisfied(new_state):
+            new_state.reward += goal.reward
+        return new_state
+
     def get_cost(self, state):
         return self.effect.get_cost(state)
 
-    def bind(self, sigma):
-        return Action(self.name, self.parameters.bind(sigma),
-                self.precondition.bind(sigma), self.effect.bind(sigma))
+    def bind(self, sigma, table=None):
+        return Action(self.name, self.parameters.bind(sigma, table),
+                self.precondition.bind(sigma, table), self.effect.bind(sigma, table))
 
     def copy(self):
-        return deepcopy(self)
+        """ Copy with its own parameter list. The precondition and the effect
+        are shared, since they are not modified once built """
+        return Action(self.name, self.parameters.copy(), self.precondition,
+                self.effect)
 
     def modified_predicates(self):
         return self.effect.modified_predicates()
@@ -1052,6 +1329,11 @@ class Action:
     def modified_functions(self):
         return self.effect.modified_functions()
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_caches"] = {}
+        return state
+
     def tuple_representation(self):
         return (self.name,*(obj.name for obj in self.parameters))
 
@@ -1072,6 +1354,9 @@ class Action:
 
 class Domain:
 
+    # maximum number of ground actions memoized by retrieve_action
+    ACTION_CACHE_SIZE = 4096
+
     def __init__(self, name="", requirements=None, types=None, constants=None,
             predicates=None, functions=None, actions=None):
         self.name = name
@@ -1081,6 +1366,7 @@ class Domain:
         self.predicates = [] if predicates is None else predicates
         self.functions = [] if functions is None else functions
         self.actions = [] if actions is None else actions
+        self._caches = {}
 
     def allows_equality_predicate(self):
         return ":equality" in self.requirements or ":adl" in self.requirements
@@ -1100,33 +1386,94 @@ class Domain:
             allfuncs.append(Function("reward"))
         return allfuncs
 
-    def retrieve_action(self, name, *args):
-        action = None
-        for a in self.actions:
-            if a.name == name:
-                action = a
-                if args:
-                    action = a.bind({param.name: arg
-                        for param,arg in zip(a.parameters, args)})
-        return action
+    def _symbol_tables(self):
+        """ Name to Predicate and name to Function tables, including the
+        equality predicate and the reward fluent when the requirements allow
+        them """
+        key = (id(self.predicates), len(self.predicates), id(self.functions),
+                len(self.functions), id(self.requirements), len(self.requirements))
+        def build():
+            predicates = {p.name: p for p in self.all_predicates()}
+            functions = {f.name: f for f in self.all_functions()}
+            return predicates, functions
+        return cached(self, "symbols", key, build)
+
+    def get_predicate(self, name):
+        return self._symbol_tables()[0].get(name)
+
+    def get_function(self, name):
+        return self._symbol_tables()[1].get(name)
+
+    def is_predicate(self, name):
+        return name in self._symbol_tables()[0]
+
+    def is_function(self, name):
+        return name in self._symbol_tables()[1]
+
+    def _actions_key(self):
+        """ Fingerprint of the actions, for the caches that depend on them """
+        return (id(self.actions), tuple((id(a), a.name, id(a.parameters),
+            len(a.parameters), id(a.precondition), id(a.effect)) for a in self.actions))
+
+    def _action_table(self):
+        """ Name to action table, along with a LRU cache of the ground actions
+        bound from them. Both are rebuilt whenever the actions change """
+        def build():
+            return {a.name: a for a in self.actions}, LRUCache(self.ACTION_CACHE_SIZE)
+        return cached(self, "actions", self._actions_key(), build)
+
+    def _modified_symbols(self):
+        """ Names of the predicates and of the functions modified by some
+        action, rebuilt whenever the actions change """
+        def build():
+            predicates = set()
+            # the reward fluent, if present, should be considered modifiable
+            functions = set(["reward"])
+            for a in self.actions:
+                predicates.update(a.modified_predicates())
+                functions.update(a.modified_functions())
+            return predicates, functions
+        return cached(self, "modified", self._actions_key(), build)
+
+    def retrieve_action(self, name, *args, table=None):
+        """ Action with the given name, bound to the given arguments if there
+        are any. Ground actions are memoized, so the same instance may be
+        returned by several calls and it should not be modified """
+        actions, ground = self._action_table()
+        action = actions.get(name)
+        if action is None or not args:
+            return action
+        key = (table, name, args)
+        grop = ground.get(key)
+        if grop is None:
+            grop = action.bind({param.name: arg
+                for param,arg in zip(action.parameters, args)}, table)
+            ground.put(key, grop)
+        return grop
 
     def get_static_predicates(self):
-        modifiable = set()
-        for a in self.actions:
-            modifiable.update(a.modified_predicates())
+        modifiable = self._modified_symbols()[0]
         static = [p for p in self.all_predicates() if p.name not in modifiable]
         return static
 
     def get_static_functions(self):
-        modifiable = set()
-        # the reward fluent, if present, should be considered modifiable
-        modifiable.add("reward")
-        for a in self.actions:
-            modifiable.update(a.modified_functions())
+        modifiable = self._modified_symbols()[1]
         return [f for f in self.all_functions() if f.name not in modifiable]
 
     def copy(self):
-        return deepcopy(self)
+        """ Copy with its own lists of requirements, types, constants,
+        predicates, functions and actions, so they can be modified without
+        affecting this domain. The elements of the lists are shared """
+        clone = Domain(self.name, self.requirements.copy(), None,
+                self.constants.copy(), self.predicates.copy(),
+                self.functions.copy(), [a.copy() for a in self.actions])
+        clone.type_hierarchy = self.type_hierarchy.copy()
+        return clone
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_caches"] = {}
+        return state
 
     def expand_probabilistic_effects(self):
         for a in self.actions:
@@ -1168,9 +1515,20 @@ class Goal:
         self.query = query
         self.reward = reward
         self.metric = metric
+        self._caches = {}
+
+    def is_satisfied(self, state):
+        """ Whether the state satisfies the goal query, evaluated through the
+        compiled query (see Query.compile) """
+        return cached(self, "query", self.query, lambda: self.query.compile())(state, ())
 
     def copy(self):
-        return deepcopy(self)
+        return Goal(self.query, self.reward, self.metric)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_caches"] = {}
+        return state
 
     def __str__(self):
         ret = ""
@@ -1188,7 +1546,8 @@ class InitialState:
         self.probabilistic = [] if probabilistic is None else probabilistic
 
     def copy(self):
-        return deepcopy(self)
+        return InitialState(self.predicates.copy(), self.functions.copy(),
+                self.probabilistic.copy())
 
     def get_state(self, problem):
         # [TODO] Probabilistic
@@ -1225,30 +1584,144 @@ class Problem:
         self.init = InitialState() if init is None else init
         self.goal = Goal(EmptyQuery()) if goal is None else goal
         self.static_functions = {}
+        self.intern_table = InternTable()
+        self.packed_states = False
+        self._caches = {}
 
     def all_objects_of_type(self, type_=None):
-        objects_of_type = []
-        for obj in self.objects:
-            inferred = inferred_types(self.domain.type_hierarchy, obj.type)
-            if type_ in inferred: objects_of_type.append(obj.name)
-        for obj in self.domain.constants:
-            inferred = inferred_types(self.domain.type_hierarchy, obj.type)
-            if type_ in inferred: objects_of_type.append(obj.name)
-        return objects_of_type
+        """ Names of the objects and constants of the given type or of any of
+        its subtypes. The returned list is shared, so it must not be modified """
+        # untyped parameters may take any object
+        if type_ is None: type_ = "object"
+        return self._objects_by_type()[0].get(type_, [])
+
+    def objects_of_type_set(self, type_=None):
+        """ Like all_objects_of_type, but returns a frozenset """
+        if type_ is None: type_ = "object"
+        return self._objects_by_type()[1].get(type_, frozenset())
+
+    def _objects_by_type(self):
+        """ Type to object names index (as lists and as sets), with each
+        object listed under all the types it inherits from. It is rebuilt
+        whenever the objects, the constants or the type hierarchy change """
+        domain = self.domain
+        key = (id(domain), id(self.objects.objects), len(self.objects),
+                id(domain.constants.objects), len(domain.constants),
+                id(domain.type_hierarchy), tuple(domain.type_hierarchy.items()))
+        def build():
+            closure = {}
+            index = {}
+            for obj in (*self.objects, *domain.constants):
+                try:
+                    inferred = closure[obj.type]
+                except KeyError:
+                    inferred = closure[obj.type] = inferred_types(
+                            domain.type_hierarchy, obj.type)
+                for type_ in inferred:
+                    index.setdefault(type_, []).append(obj.name)
+            return index, {t: frozenset(names) for t, names in index.items()}
+        return cached(self, "objects_by_type", key, build)
 
     def ground_operators(self):
-        for action in self.domain.actions:
-            for sigma in all_possible_assignments(self, action.parameters):
-                yield action.bind(sigma)
-
-    def get_initial_state(self):
+        """ Iterator over the ground operators that are reachable from the
+        initial state (see grounding.Grounder) """
+        return iter(self.grounder().operators)
+
+    def grounder(self):
+        """ Grounder with the reachable ground operators of this problem and
+        the statistics of the grounding. It is rebuilt whenever the initial
+        state, the objects or the actions change """
+        from .grounding import Grounder
+        key = (id(self.init.predicates), len(self.init.predicates),
+                id(self.objects), len(self.objects), id(self.domain),
+                tuple((id(a), id(a.precondition), id(a.effect))
+                    for a in self.domain.actions),
+                id(self.domain.constants), len(self.domain.constants))
+        def build():
+            grounder = Grounder(self)
+            grounder.ground()
+            return grounder
+        return cached(self, "grounder", key, build)
+
+    def static_facts(self):
+        """ StaticFacts of the problem (the static predicates and functions and
+        their values in the initial state), rebuilt whenever the initial state
+        or the actions change """
+        from .grounding import StaticFacts
+        key = (id(self.init.predicates), len(self.init.predicates),
+                id(self.init.functions), len(self.init.functions), id(self.domain),
+                self.domain._actions_key())
+        return cached(self, "static_facts", key, lambda: StaticFacts(self))
+
+    def ground_operator(self, name, *args):
+        """ Reachable ground operator with the given name and arguments (with
+        its precondition specialized, see grounding.Grounder), or None if it
+        is not reachable """
+        return self.grounder().operator(name, *args)
+
+    def successor_generator(self):
+        """ SuccessorGenerator over the reachable ground operators, rebuilt
+        along with them """
+        from .grounding import SuccessorGenerator
+        grounder = self.grounder()
+        return cached(self, "successor_generator", grounder,
+                lambda: SuccessorGenerator(grounder.operators))
+
+    def batch_task(self):
+        """ BatchTask over the reachable ground operators, to evaluate and
+        advance batches of states with numpy (see batch.BatchTask) """
+        from .batch import BatchTask
+        grounder = self.grounder()
+        return cached(self, "batch_task", (grounder, id(self.goal),
+            id(self.goal.query)), lambda: BatchTask(self, grounder.operators))
+
+    def relaxed_task(self):
+        """ Delete relaxation of the reachable ground operators, used by the
+        h_max, h_add and h_FF heuristics (see heuristics.RelaxedTask) """
+        from .heuristics import RelaxedTask
+        grounder = self.grounder()
+        return cached(self, "relaxed_task", (grounder, id(self.goal),
+            id(self.goal.query), self.goal.metric),
+            lambda: RelaxedTask(self, grounder.operators))
+
+    def landmark_graph(self):
+        """ Fact landmarks and orderings of the delete relaxation, extracted
+        once and rebuilt along with it (see heuristics.LandmarkGraph) """
+        from .heuristics import LandmarkGraph
+        relaxed = self.relaxed_task()
+        return cached(self, "landmark_graph", relaxed,
+                lambda: LandmarkGraph(relaxed))
+
+    def applicable_actions(self, state):
+        """ List of the ground operators that are applicable in the state """
+        return self.successor_generator().applicable(state)
+
+    def get_initial_state(self, packed=None):
+        """ Initial state of the problem. If packed is True (by default, if
+        the problem's packed_states flag is set) the state is a PackedState """
         s0 = self.init.get_state(self)
         if self.domain.allows_reward_fluent(): s0.reward = 0
+        if self.packed_states if packed is None else packed:
+            s0 = s0.pack()
         return s0
 
+    def retrieve_action(self, name, *args):
+        """ Like Domain.retrieve_action, but the atoms of the ground action are
+        interned in this problem's table """
+        return self.domain.retrieve_action(name, *args, table=self.intern_table)
+
     def copy(self):
-        return Problem(self.name, self.domain, self.objects.copy(),
+        clone = Problem(self.name, self.domain, self.objects.copy(),
                 self.init.copy(), self.goal.copy())
+        # ground atoms are the same across copies, so the table is shared
+        clone.intern_table = self.intern_table
+        clone.packed_states = self.packed_states
+        return clone
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_caches"] = {}
+        return state
 
     def remove_mdp_features(self):
         self.goal.reward = None
@@ -1271,9 +1744,24 @@ class Problem:
 
 
 class SymbolicState:
+    """ Set of true atoms, along with the total cost and the reward. The atoms
+    are stored as a chain of frozen StateLayers plus the atoms added and
+    deleted since the last layer, so copying a state is cheap and successors
+    share the atoms they do not modify with their parent (see copy) """
+
+    __slots__ = ("_layer", "_added", "_deleted", "total_cost", "reward",
+            "problem", "_hash", "_index")
+
+    # layers deeper than this are flattened into a layer with all the atoms
+    MAX_DEPTH = 8
 
     def __init__(self, predicates=None, functions=None, problem=None):
-        self.predicates = set() if predicates is None else set(predicates)
+        if predicates is not None and problem is not None:
+            predicates = map(problem.intern_table.atom, predicates)
+        self._layer = StateLayer(predicates or ())
+        # the sets of added and deleted atoms are only allocated when needed
+        self._added = NO_ATOMS
+        self._deleted = NO_ATOMS
         self.total_cost = None
         self.reward = None
         self.problem = problem
@@ -1281,24 +1769,87 @@ class SymbolicState:
             for fun, val in functions.items():
                 self.set_function_value(fun, val)
         self._hash = None
+        self._index = None
+
+    @property
+    def predicates(self):
+        """ New set with the atoms that are true in the state """
+        atoms = self._layer.materialize()
+        atoms.difference_update(self._deleted)
+        atoms.update(self._added)
+        return atoms
+
+    @predicates.setter
+    def predicates(self, predicates):
+        self._layer = StateLayer(predicates)
+        self._added = NO_ATOMS
+        self._deleted = NO_ATOMS
+        self._hash = None
+        self._index = None
 
     def add_predicate(self, predicate):
-        self.predicates.add(predicate)
-        self._hash = None
+        if self.problem is not None:
+            predicate = self.problem.intern_table.atom(predicate)
+        # the hash, if known, is updated incrementally (see __hash__)
+        if self._hash is not None and predicate not in self._added and (
+                predicate in self._deleted or not self._layer.contains(predicate)):
+            self._hash ^= zobrist_key(predicate)
+        if self._added is NO_ATOMS: self._added = set()
+        self._added.add(predicate)
+        if self._deleted: self._deleted.discard(predicate)
+        self._index = None
 
     def delete_predicate(self, predicate):
-        self.predicates.discard(predicate)
-        self._hash = None
+        if self._hash is not None and predicate not in self._deleted and (
+                predicate in self._added or self._layer.contains(predicate)):
+            self._hash ^= zobrist_key(predicate)
+        if self._deleted is NO_ATOMS: self._deleted = set()
+        self._deleted.add(predicate)
+        if self._added: self._added.discard(predicate)
+        self._index = None
+
+    def atoms_by_name(self):
+        """ Predicate name to the list of argument names of the true atoms with
+        that name. The index is built on demand and kept until the state is
+        modified """
+        if self._index is None:
+            index = {}
+            for atom in self.predicates:
+                index.setdefault(atom.name, []).append(
+                        tuple(o.name for o in atom.arguments))
+            self._index = index
+        return self._index
+
+    def freeze(self):
+        """ Moves the atoms added and deleted since the last layer into a new
+        frozen layer, flattening the chain if it gets too deep. Returns the
+        state's layer """
+        if self._added or self._deleted:
+            layer = self._layer
+            if layer.depth >= self.MAX_DEPTH:
+                self._layer = StateLayer(self.predicates)
+            else:
+                self._layer = StateLayer(self._added, self._deleted, layer)
+            self._added = NO_ATOMS
+            self._deleted = NO_ATOMS
+        return self._layer
 
     def copy(self):
-        clone = SymbolicState(self.predicates.copy(), problem=self.problem)
+        """ Copy that shares the (frozen) layers of this state, so it takes
+        constant time and memory regardless of the number of atoms """
+        clone = SymbolicState(problem=self.problem)
+        clone._layer = self.freeze()
         clone.total_cost = self.total_cost
         clone.reward = self.reward
+        clone._hash = self._hash
+        clone._index = self._index
         return clone
 
     def has_predicate(self, predicate):
         if predicate.name == "=": return predicate.arguments[0] == predicate.arguments[1]
-        return predicate in self.predicates
+        if predicate in self._added: return True
+        if predicate in self._deleted: return False
+        return self._layer.contains(predicate)
 
     def set_function_value(self, function, value):
         if function.name == "total-cost":
@@ -1318,9 +1869,15 @@ class SymbolicState:
         return self.problem.static_functions[function] 
 
     def applicable_actions(self):
-        for grop in self.problem.ground_operators():
-            if grop.is_applicable(self):
-                yield grop
+        yield from self.problem.applicable_actions(self)
+
+    def pack(self):
+        """ PackedState equivalent to this state """
+        packed = PackedState(self.problem.intern_table.encode(self.predicates),
+                self.problem)
+        packed.total_cost = self.total_cost
+        packed.reward = self.reward
+        return packed
 
     def to_initial_state(self):
         functions = {}
@@ -1331,13 +1888,24 @@ class SymbolicState:
         return InitialState(list(self.predicates), functions)
 
     def __hash__(self):
+        """ Zobrist hash: the XOR of the keys of the true atoms. It is computed
+        once and then kept up to date by add_predicate and delete_predicate,
+        so hashing a successor costs O(1) per atom changed by the effect """
         if self._hash is None:
-            self._hash = hash(frozenset(self.predicates))
+            self._hash = reduce(xor, map(zobrist_key, self.predicates), 0)
         return self._hash
 
     def __eq__(self, other):
+        if self is other: return True
+        if type(other) is SymbolicState and hash(self) != hash(other): return False
         return self.predicates == other.predicates
 
+    def __getstate__(self):
+        # the keys derive from the atoms' hashes, which are salted per process
+        state = slots_state(self)
+        state["_hash"] = None
+        return None, state
+
     def __str__(self):
         ret = "State from problem " + self.problem.name + ":\n  "
         ret += "\n  ".join(p for p in sorted(str(p_) for p_ in self.predicates))
@@ -1348,6 +1916,244 @@ class SymbolicState:
         return ret
 
 
+NO_ATOMS = frozenset()
+
+
+class StateLayer:
+    """ Frozen set of atoms, stored as the atoms added and deleted with
+    respect to a parent layer. Root layers (without parent) store all the
+    atoms """
+
+    __slots__ = ("added", "deleted", "parent", "depth")
+
+    def __init__(self, added=(), deleted=(), parent=None):
+        self.added = frozenset(added)
+        self.deleted = frozenset(deleted)
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+
+    def contains(self, atom):
+        layer = self
+        while layer is not None:
+            if atom in layer.added: return True
+            if atom in layer.deleted: return False
+            layer = layer.parent
+        return False
+
+    def materialize(self):
+        """ New set with all the atoms of the layer """
+        chain = []
+        layer = self
+        while layer is not None:
+            chain.append(layer)
+            layer = layer.parent
+        atoms = set()
+        for layer in reversed(chain):
+            atoms.difference_update(layer.deleted)
+            atoms.update(layer.added)
+        return atoms
+
+
+class PackedState(SymbolicState):
+    """ Compact state in which the true atoms are stored as the bits of an
+    integer, indexed by the fact ids of the problem's InternTable. Adding,
+    deleting and checking atoms, as well as hashing and comparing states, are
+    integer operations. The predicates are decoded on demand, so the state can
+    be used wherever a SymbolicState is expected. Packed states are not
+    interchangeable with unpacked ones as dictionary keys, since their hashes
+    differ """
+
+    __slots__ = ("bits",)
+
+    def __init__(self, bits=0, problem=None):
+        self.bits = bits
+        self.total_cost = None
+        self.reward = None
+        self.problem = problem
+        self._index = None
+
+    @property
+    def predicates(self):
+        return set(self.problem.intern_table.decode(self.bits))
+
+    def add_predicate(self, predicate):
+        self.bits |= 1 << self.problem.intern_table.fact_id(predicate)
+        self._index = None
+
+    def delete_predicate(self, predicate):
+        self.bits &= ~(1 << self.problem.intern_table.fact_id(predicate))
+        self._index = None
+
+    def copy(self):
+        clone = PackedState(self.bits, self.problem)
+        clone.total_cost = self.total_cost
+        clone.reward = self.reward
+        clone._index = self._index
+        return clone
+
+    def has_predicate(self, predicate):
+        if predicate.name == "=": return predicate.arguments[0] == predicate.arguments[1]
+        return (self.bits >> self.problem.intern_table.fact_id(predicate)) & 1 == 1
+
+    def pack(self):
+        return self.copy()
+
+    def unpack(self):
+        """ SymbolicState equivalent to this state """
+        state = SymbolicState(problem=self.problem)
+        state.predicates = self.predicates
+        state.total_cost = self.total_cost
+        state.reward = self.reward
+        return state
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def __eq__(self, other):
+        if isinstance(other, PackedState) and \
+                self.problem.intern_table is other.problem.intern_table:
+            return self.bits == other.bits
+        return self.predicates == other.predicates
+
+
+class InternTable:
+    """ Flyweight table of ground objects and atoms. Every object and atom
+    interned in the same table exists only once, so comparisons and hash
+    lookups among interned instances resolve by identity """
+
+    def __init__(self):
+        self.objects = {}
+        self.atoms = {}
+        # integer ids of the atoms used as facts of packed states
+        self.facts = []
+        self.fact_ids = {}
+
+    def object(self, name, type_=None):
+        key = (name, type_)
+        obj = self.objects.get(key)
+        if obj is None:
+            obj = self.objects[key] = Object(name, type_)
+        return obj
+
+    def atom(self, functional):
+        """ Canonical instance of the given atom """
+        args = functional.arguments
+        key = (functional.name, *(o.name for o in args))
+        atom = self.atoms.get(key)
+        if atom is None:
+            atom = copy(functional)
+            atom.arguments = ObjectList(*(self.object(o.name, o.type) for o in args))
+            self.atoms[key] = atom
+        return atom
+
+    def bind(self, functional, sigma):
+        """ Canonical instance of functional.bind(sigma). Instead of building
+        the bound functional and then looking it up, the lookup is done
+        directly with the names of the bound arguments """
+        return self.ground(functional, [sigma.get(o.name, o.name)
+            for o in functional.arguments])
+
+    def ground(self, functional, names):
+        """ Canonical instance of the functional with its arguments replaced by
+        the objects with the given names """
+        args = functional.arguments
+        key = (functional.name, *names)
+        atom = self.atoms.get(key)
+        if atom is None:
+            atom = Functional(functional.name, ObjectList(*(self.object(n, o.type)
+                for n, o in zip(names, args))))
+            self.atoms[key] = atom
+        return atom
+
+    def fact_id(self, functional):
+        """ Integer id of the given atom. Ids are assigned on demand, so only
+        the atoms that are actually used as facts get one """
+        try:
+            return self.fact_ids[functional]
+        except KeyError:
+            atom = self.atom(functional)
+            fid = self.fact_ids[atom] = len(self.facts)
+            self.facts.append(atom)
+            return fid
+
+    def encode(self, atoms):
+        """ Integer with the bits of the given atoms set """
+        bits = 0
+        for atom in atoms:
+            bits |= 1 << self.fact_id(atom)
+        return bits
+
+    def decode(self, bits):
+        """ Generator over the atoms whose bits are set in the given integer """
+        facts = self.facts
+        while bits:
+            low = bits & -bits
+            yield facts[low.bit_length()-1]
+            bits ^= low
+
+    def __len__(self):
+        return len(self.atoms)
+
+
+class LRUCache:
+    """ Bounded mapping that evicts the least recently used entries """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            self.entries.move_to_end(key)
+        except KeyError:
+            return default
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class AliasTable:
+    """ Walker's alias table, to sample an index from a discrete distribution
+    in constant time. If the probabilities add up to less than 1, the
+    remaining mass goes to an extra index, len(probabilities) """
+
+    __slots__ = ("probability", "alias")
+
+    def __init__(self, probabilities):
+        probabilities = list(probabilities)
+        remaining = 1.0 - sum(probabilities)
+        if remaining > 1e-9:
+            probabilities.append(remaining)
+        n = len(probabilities)
+        total = sum(probabilities)
+        scaled = [p*n/total for p in probabilities]
+        self.probability = [1.0]*n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.probability[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        # the indices left in either list (due to rounding) keep probability 1
+
+    def sample(self, rng=None):
+        """ Sampled index. rng is any object with a random() method, like
+        random.Random (by default, the random module's global generator) """
+        u = (random() if rng is None else rng.random()) * len(self.probability)
+        idx = int(u)
+        return idx if u - idx < self.probability[idx] else self.alias[idx]
+
+
 ####################
 ## HELPER METHODS ##
 ####################
@@ -1374,17 +2180,192 @@ def to_type_hierarchy(types):
     raise Exception("wrong type")
 
 
+ZOBRIST_KEYS = {}
+
+def zobrist_key(atom):
+    """ Pseudo-random 64-bit key of an atom, obtained by mixing its hash with
+    splitmix64. Keys are memoized by hash, so atoms are not kept alive """
+    h = hash(atom)
+    z = ZOBRIST_KEYS.get(h)
+    if z is None:
+        z = (h + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        z = ZOBRIST_KEYS[h] = z ^ (z >> 31)
+    return z
+
+
+def slots_state(obj):
+    """ Dictionary with the values of all the slots of obj """
+    return {attr: getattr(obj, attr) for cls in type(obj).__mro__
+            for attr in getattr(cls, "__slots__", ()) if hasattr(obj, attr)}
+
+
+def cached(obj, name, key, build):
+    """ Memoizes the result of build() in obj._caches under the given name. The
+    value is rebuilt whenever key (a cheap fingerprint of the data the value
+    depends on) changes """
+    entry = obj._caches.get(name)
+    if entry is None or entry[0] != key:
+        entry = (key, build())
+        obj._caches[name] = entry
+    return entry[1]
+
+
+def compile_argument(obj, parameters):
+    """ Callable that maps the tuple of arguments bound to the given parameters
+    to the name of the object """
+    try:
+        # the last occurrence of a variable shadows the previous ones
+        return itemgetter(len(parameters) - 1 - parameters[::-1].index(obj.name))
+    except ValueError:
+        name = obj.name
+        return lambda args: name
+
+
+def compile_atom(functional, parameters):
+    """ Callable that maps a state and the tuple of arguments bound to the
+    given parameters to the ground atom (interned in the state's problem) """
+    getters = [compile_argument(o, parameters) for o in functional.arguments]
+    if not any(o.name in parameters for o in functional.arguments):
+        return lambda state, args: functional
+    def atom(state, args):
+        names = [get(args) for get in getters]
+        if state.problem is None:
+            return Functional(functional.name, ObjectList(*(Object(n, o.type)
+                for n, o in zip(names, functional.arguments))))
+        return state.problem.intern_table.ground(functional, names)
+    return atom
+
+
+def compile_binary(function, lhs, rhs, parameters):
+    lhs = lhs.compile(parameters)
+    rhs = rhs.compile(parameters)
+    return lambda state, args: function(lhs(state, args), rhs(state, args))
+
+
+def necessary_atoms(query, holds=True):
+    """ Positive atoms that are true in every state in which the query holds
+    (or fails, if holds is False) """
+    if isinstance(query, PredicateQuery):
+        return [query.predicate] if holds and query.predicate.name != "=" else []
+    if isinstance(query, NotQuery):
+        return necessary_atoms(query.negated, not holds)
+    if isinstance(query, AndQuery) and holds:
+        return [a for q in query.queries for a in necessary_atoms(q, True)]
+    if isinstance(query, OrQuery) and not holds:
+        return [a for q in query.queries for a in necessary_atoms(q, False)]
+    if isinstance(query, ImplyQuery) and not holds:
+        return necessary_atoms(query.lhs, True) + necessary_atoms(query.rhs, False)
+    return []
+
+
+def has_nested_probabilistic(effect):
+    """ Whether an outcome (see Action.outcomes) still has probabilistic
+    effects, nested in universal or conditional effects """
+    if isinstance(effect, ProbabilisticEffect):
+        return True
+    if isinstance(effect, AndEffect):
+        return any(has_nested_probabilistic(e) for e in effect.effects)
+    if isinstance(effect, ForallEffect):
+        return has_nested_probabilistic(effect.effect)
+    if isinstance(effect, ConditionalEffect):
+        return has_nested_probabilistic(effect.rhs)
+    return False
+
+
+def outcome_distribution(state, effect, partial):
+    """ Distribution (a dictionary from states to probabilities) of the
+    successors of a state after applying a ground effect to the partial
+    successors in the given distribution, branching on the outcomes of the
+    probabilistic effects. Conditions are evaluated in the original state, as
+    in ConditionalEffect.apply """
+    if isinstance(effect, AndEffect):
+        for e in effect.effects:
+            partial = outcome_distribution(state, e, partial)
+        return partial
+    if isinstance(effect, ForallEffect):
+        table = state.problem.intern_table
+        for sigma in effect.assignments(state):
+            partial = outcome_distribution(state, effect.effect.bind(sigma, table), partial)
+        return partial
+    if isinstance(effect, ConditionalEffect):
+        return outcome_distribution(state, effect.rhs, partial) \
+                if effect.lhs.eval(state) else partial
+    result = {}
+    if isinstance(effect, ProbabilisticEffect):
+        # the remaining mass leaves the partial successors unchanged
+        branches = effect.effects + [(1 - sum(p for p, _ in effect.effects), None)]
+        for p, e in branches:
+            if p < 1e-6: continue
+            outcome = partial if e is None else outcome_distribution(state, e, partial)
+            for succ, q in outcome.items():
+                result[succ] = result.get(succ, 0) + p*q
+        return result
+    for succ, q in partial.items():
+        succ = effect.apply(state, succ.copy())
+        result[succ] = result.get(succ, 0) + q
+    return result
+
+
+def join_assignments(state, parameters, atoms, sigma=None):
+    """ Generator over the tuples of objects (one per parameter) for which all
+    the given atoms are true in the state. The atoms may contain the variables
+    of parameters and of sigma (the assignment of the enclosing scope). The
+    atoms are matched against the state's per-predicate index, and the
+    parameters that appear in no atom range over all the objects of their
+    type. With no atoms, this is the same as all_possible_assignments """
+    problem = state.problem
+    names = [p.name for p in parameters]
+    types = {p.name: problem.objects_of_type_set(p.type) for p in parameters}
+    binding = {} if sigma is None else \
+            {n: v for n, v in sigma.items() if n not in types}
+    index = state.atoms_by_name() if atoms else None
+    # atoms with more known arguments first
+    atoms = sorted(atoms, key=lambda a: -sum(o.name in binding or o.name[0] != "?"
+        for o in a.arguments))
+    def join(idx, binding):
+        if idx == len(atoms):
+            free = [p for p in parameters if p.name not in binding]
+            domains = [problem.all_objects_of_type(p.type) for p in free]
+            for values in product(*domains):
+                full = dict(binding)
+                full.update(zip((p.name for p in free), values))
+                yield tuple(full[n] for n in names)
+            return
+        atom = atoms[idx]
+        args = atom.arguments
+        for values in index.get(atom.name, ()):
+            if len(values) != len(args): continue
+            extended = binding
+            for obj, value in zip(args, values):
+                name = obj.name
+                bound = extended.get(name)
+                if bound is not None:
+                    if bound != value: break
+                elif name in types:
+                    if value not in types[name]: break
+                    if extended is binding: extended = dict(binding)
+                    extended[name] = value
+                elif name != value:
+                    break
+            else:
+                yield from join(idx+1, extended)
+    return join(0, binding)
+
+
 def lisp_list_to_str(*args):
     return "({})".format(" ".join(str(a) for a in args))
 
 
 def simplify_and_or(obj, attr, empty_class):
-    l = getattr(obj, attr)
-    l = [e for e in map(lambda e: e.simplify(), l) if not e.is_empty()]
-    setattr(obj, attr, l)
+    original = getattr(obj, attr)
+    l = [e for e in map(lambda e: e.simplify(), original) if not e.is_empty()]
     if len(l) == 1: return l[0]
     if not l: return empty_class()
-    return obj
+    if len(l) == len(original) and all(a is b for a, b in zip(l, original)):
+        return obj
+    return type(obj)(*l)
 
 
 def type_hierarchy_to_str(hierarchy):
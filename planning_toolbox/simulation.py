@@ -3,10 +3,14 @@ from time import time
 from .imagine.imagine_state import ImagineState
 
 class PpddlSimulator:
+    """ Simulator that applies the actions to its own copy of the state.
+    Outcomes are sampled with rng (any object with a random() method, like
+    random.Random; by default, the random module's global generator) """
 
-    def __init__(self, problem=None, timeout=180):
+    def __init__(self, problem=None, timeout=180, rng=None):
         self.timeout = timeout
         self.problem = problem
+        self.rng = rng
         self.reset(problem)
 
     def reset(self, problem=None):
@@ -26,10 +30,12 @@ class PpddlSimulator:
         done = False
         timeout = remaining <= 0
         if not timeout:
-            grop = self.problem.domain.retrieve_action(*action)
-            new_state = grop.apply(self.current_state)
+            # reachable operators come with their preconditions specialized
+            grop = self.problem.ground_operator(*action) or \
+                    self.problem.retrieve_action(*action)
+            new_state = grop.apply(self.current_state, self.rng)
             if new_state:
-                done = self.problem.goal.query.eval(new_state)
+                done = self.problem.goal.is_satisfied(new_state)
                 self.current_state = new_state
         return done, timeout, self.current_state
 
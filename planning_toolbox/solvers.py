@@ -2,8 +2,12 @@ import re
 import subprocess
 import time
 
+from heapq import heappush, heappop
+from itertools import count
 from tempfile import NamedTemporaryFile
 
+from .heuristics import h_ff
+
 
 class CmdPlanner:
 
@@ -153,6 +157,108 @@ class FDPlanner(CmdPlanner):
         return result
 
 
+class SearchPlanner:
+    """ In-process forward search planner over the ground operators of a
+    (deterministic) problem. It is called like a CmdPlanner and returns the
+    same result dictionary, without writing files or spawning processes.
+
+    The algorithm is greedy best-first search ("gbfs", which orders the open
+    list by h), A* ("astar", by g+h) or weighted A* ("wastar", by g+weight*h).
+    heuristic is a factory that takes the problem and returns a function from
+    states to estimates (float("inf") for dead ends), like the ones in the
+    heuristics module; by default h_FF is used. Path dependent heuristics
+    (such as heuristics.LandmarkCount) also have a method reached(parent,
+    action, state), which is called for every generated state before it is
+    evaluated. Actions cost their increase of total-cost if the problem
+    minimizes a metric, and 1 otherwise """
+
+    ALGORITHMS = ("gbfs", "astar", "wastar")
+
+    # expansions between checks of the timeout
+    CHECK_EVERY = 100
+
+    def __init__(self, algorithm="gbfs", heuristic=None, weight=2):
+        assert algorithm in SearchPlanner.ALGORITHMS
+        self.algorithm = algorithm
+        self.heuristic = h_ff if heuristic is None else heuristic
+        self.weight = weight
+
+    def priority(self, g, h):
+        if self.algorithm == "gbfs": return (h, g)
+        if self.algorithm == "astar": return (g+h, h)
+        return (g+self.weight*h, h)
+
+    def search(self, problem, timeout=None):
+        start = time.time()
+        h = self.heuristic(problem)
+        reached = getattr(h, "reached", None)
+        metric = problem.goal.metric
+        use_costs = bool(metric) and metric[0] == "minimize"
+        reopen = self.algorithm != "gbfs"
+        s0 = problem.get_initial_state()
+        # best g of every generated state and the (parent, operator) it was
+        # reached from
+        g = {s0: 0}
+        parent = {s0: None}
+        h0 = h(s0)
+        stats = {"expanded": 0, "generated": 1, "evaluated": 1}
+        result = {"plan-found": False, "plan": None, "total-cost": None,
+                "timeout": False}
+        result.update(stats)
+        if h0 == float("inf"):
+            return result
+        tie = count()
+        open_ = [(self.priority(0, h0), next(tie), s0, 0)]
+        closed = set()
+        goal = problem.goal
+        while open_:
+            _, _, state, g_state = heappop(open_)
+            if g_state > g[state] or (not reopen and state in closed):
+                continue
+            if goal.is_satisfied(state):
+                plan = []
+                node = state
+                while parent[node] is not None:
+                    node, op = parent[node]
+                    plan.append(op.tuple_representation())
+                plan.reverse()
+                result["plan-found"] = True
+                result["plan"] = plan
+                result["total-cost"] = g_state
+                break
+            closed.add(state)
+            stats["expanded"] += 1
+            if timeout is not None and stats["expanded"] % self.CHECK_EVERY == 0 \
+                    and time.time() - start > timeout:
+                result["timeout"] = True
+                break
+            for op in problem.applicable_actions(state):
+                cost = op.get_cost(state) if use_costs else 1
+                succ = op.effect.apply(state)
+                g_succ = g_state + cost
+                stats["generated"] += 1
+                if reached is not None:
+                    reached(state, op, succ)
+                known = g.get(succ)
+                if known is not None and (g_succ >= known or not reopen):
+                    continue
+                h_succ = h(succ)
+                stats["evaluated"] += 1
+                if h_succ == float("inf"):
+                    continue
+                g[succ] = g_succ
+                parent[succ] = (state, op)
+                heappush(open_, (self.priority(g_succ, h_succ), next(tie), succ, g_succ))
+        result.update(stats)
+        return result
+
+    def __call__(self, problem, timeout=None):
+        start = time.time()
+        result = self.search(problem, timeout)
+        result["time-wall"] = result["total-elapsed"] = time.time() - start
+        return result
+
+
 #############
 # UTILITIES #
 #############